@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""Local stand-in for a solana cluster, used by run_benchmarks.py.
+
+The rpc endpoint answers getSlot and getClusterNodes. Every synthetic node listens on its own port of 127.0.0.1
+and behaves like a snapshot server: /snapshot.tar.bz2 and /incremental-snapshot.tar.bz2 are redirected (302)
+to the archives, which are streamed at the rate of the node (per connection, with http range requests).
+Nodes can also be stale, return errors, never respond (timeout) or have their port closed.
+The plan of the cluster (the behaviour of every node) is written to --plan."""
+import argparse
+import asyncio
+import functools
+import json
+import random
+import sys
+
+parser = argparse.ArgumentParser(description='Fake solana cluster for snapshot-finder benchmarks')
+parser.add_argument('--rpc_port', default=18899, type=int, help='Port of the rpc endpoint')
+parser.add_argument('--base_port', default=20000, type=int, help='Nodes listen on base_port, base_port + 1, ...')
+parser.add_argument('--nodes', default=1000, type=int, help='The number of synthetic nodes')
+parser.add_argument('--slot', default=300000000, type=int, help='Current slot of the cluster')
+parser.add_argument('--size', default=256 * 1024 * 1024, type=int, help='Size of every archive (bytes)')
+parser.add_argument('--rate', default=50e6, type=float, help='Mean per-connection upload rate of a node (bytes/s)')
+parser.add_argument('--rate_spread', default=0.5, type=float,
+    help='Rates are drawn uniformly from rate * (1 - spread) .. rate * (1 + spread)')
+parser.add_argument('--latency', default='0.001,0.05', type=str, help='min,max response latency of a node (seconds)')
+parser.add_argument('--stale_ratio', default=0.1, type=float, help='Share of nodes with too old snapshots')
+parser.add_argument('--error_ratio', default=0.05, type=float, help='Share of nodes answering with http 500')
+parser.add_argument('--timeout_ratio', default=0.1, type=float, help='Share of nodes that never respond')
+parser.add_argument('--closed_ratio', default=0.3, type=float, help='Share of nodes with a closed rpc port')
+parser.add_argument('--seed', default=1, type=int, help='Seed of the random cluster plan')
+parser.add_argument('--plan', default=None, type=str, help='Write the plan of the cluster to this json file')
+args = parser.parse_args()
+
+CHUNK_SIZE = 64 * 1024
+# the body of every archive is this pattern repeated, so any range can be checked
+PATTERN = bytes(range(251)) * (CHUNK_SIZE // 251 + 2)
+FULL_SLOT = args.slot - 500
+
+
+def make_plan() -> list:
+    rnd = random.Random(args.seed)
+    latency_min, latency_max = (float(value) for value in args.latency.split(','))
+    kinds = [('closed', args.closed_ratio), ('timeout', args.timeout_ratio), ('error', args.error_ratio),
+             ('stale', args.stale_ratio)]
+    nodes = []
+    for i in range(args.nodes):
+        draw = rnd.random()
+        kind = 'ok'
+        for name, ratio in kinds:
+            if draw < ratio:
+                kind = name
+                break
+            draw -= ratio
+        full_slot = FULL_SLOT if kind != 'stale' else FULL_SLOT - 50000
+        nodes.append({
+            "address": f'127.0.0.1:{args.base_port + i}',
+            "kind": kind,
+            "latency": rnd.uniform(latency_min, latency_max),
+            "rate": args.rate * rnd.uniform(1 - args.rate_spread, 1 + args.rate_spread),
+            "full": f'/snapshot-{full_slot}-FakeFullHash.tar.zst',
+            "incremental": f'/incremental-snapshot-{full_slot}-{full_slot + 450}-FakeIncHash.tar.zst',
+        })
+    return nodes
+
+
+async def read_request(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        header = await reader.readline()
+        if header in (b'\r\n', b'\n', b''):
+            break
+        name, value = header.decode('latin-1').split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return method, path, headers, body
+
+
+def write_head(writer: asyncio.StreamWriter, status: str, headers: dict):
+    lines = [f'HTTP/1.1 {status}'] + [f'{name}: {value}' for name, value in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+
+async def send_body(writer: asyncio.StreamWriter, start: int, end: int, rate: float):
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    offset = start
+    while offset <= end:
+        length = min(CHUNK_SIZE, end + 1 - offset)
+        writer.write(PATTERN[offset % 251:offset % 251 + length])
+        await writer.drain()
+        offset += length
+        delay = start_time + (offset - start) / rate - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def send_archive(node: dict, method: str, headers: dict, writer: asyncio.StreamWriter):
+    start, end = 0, args.size - 1
+    response = {"Content-Type": "application/octet-stream", "Accept-Ranges": "bytes"}
+    if 'range' in headers:
+        first, last = headers['range'].split('=', 1)[1].split('-', 1)
+        start, end = int(first), min(int(last) if last else args.size - 1, args.size - 1)
+        response["Content-Range"] = f'bytes {start}-{end}/{args.size}'
+    response["Content-Length"] = end - start + 1
+    write_head(writer, '206 Partial Content' if 'range' in headers else '200 OK', response)
+    if method == 'GET':
+        await send_body(writer, start, end, node["rate"])
+    else:
+        await writer.drain()
+
+
+async def serve_node(node: dict, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    redirects = {'/snapshot.tar.bz2': node["full"], '/incremental-snapshot.tar.bz2': node["incremental"]}
+    try:
+        while True:
+            request = await read_request(reader)
+            if request is None:
+                break
+            method, path, headers, _ = request
+            if node["kind"] == 'timeout':
+                await asyncio.sleep(3600)
+            await asyncio.sleep(node["latency"])
+            if node["kind"] == 'error':
+                write_head(writer, '500 Internal Server Error', {"Content-Length": 0})
+            elif path in redirects:
+                write_head(writer, '302 Found', {"Location": redirects[path], "Content-Length": 0})
+            elif path in redirects.values():
+                await send_archive(node, method, headers, writer)
+                continue
+            else:
+                write_head(writer, '404 Not Found', {"Content-Length": 0})
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_rpc(nodes: list, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            request = await read_request(reader)
+            if request is None:
+                break
+            method = json.loads(request[3] or b'{}').get("method")
+            if method == 'getSlot':
+                result = args.slot
+            elif method == 'getClusterNodes':
+                result = [{"rpc": node["address"], "gossip": node["address"], "version": "1.18.1"} for node in nodes]
+            else:
+                result = None
+            body = json.dumps({"jsonrpc": "2.0", "id": 1, "result": result}).encode()
+            write_head(writer, '200 OK', {"Content-Type": "application/json", "Content-Length": len(body)})
+            writer.write(body)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+def raise_open_files_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        target = hard if hard != resource.RLIM_INFINITY else 65536
+        if target > soft:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+async def main():
+    nodes = make_plan()
+    servers = [await asyncio.start_server(functools.partial(serve_rpc, nodes), '127.0.0.1', args.rpc_port)]
+    for node in nodes:
+        if node["kind"] == 'closed':
+            continue
+        try:
+            servers.append(await asyncio.start_server(functools.partial(serve_node, node), '127.0.0.1',
+                                                      int(node["address"].split(':')[1]), backlog=64))
+        except OSError as bindErr:
+            print(f'Can\'t listen on {node["address"]}, the node is closed: {bindErr}', file=sys.stderr)
+            node["kind"] = 'closed'
+
+    if args.plan is not None:
+        with open(args.plan, 'w') as plan_f:
+            json.dump({"slot": args.slot, "size": args.size, "nodes": nodes}, plan_f)
+    kinds = {}
+    for node in nodes:
+        kinds[node["kind"]] = kinds.get(node["kind"], 0) + 1
+    print(json.dumps({"ready": True, "rpc": f'http://127.0.0.1:{args.rpc_port}', "nodes": kinds}), flush=True)
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+if __name__ == '__main__':
+    raise_open_files_limit()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Offline benchmarks of snapshot-finder.py. Every scenario starts fake_cluster.py, runs the finder against it
+and reports the numbers taken from run_report.json, node_cache.json and snapshot.json of the run.
+
+    python3 benchmarks/run_benchmarks.py
+    python3 benchmarks/run_benchmarks.py download --repeat 3 --finder_args "--download_connections 16"
+    python3 benchmarks/run_benchmarks.py discovery --cluster_args "--nodes 10000" --json before.json
+"""
+import argparse
+import json
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+FINDER = BENCHMARKS_DIR.parent / 'snapshot-finder.py'
+FAKE_CLUSTER = BENCHMARKS_DIR / 'fake_cluster.py'
+MB = 1e6
+
+SCENARIOS = {
+    # every snapshot is too old for --max_snapshot_age 0, the run ends right after the discovery
+    "discovery": {
+        "cluster": ['--nodes', '5000'],
+        "finder": ['--max_snapshot_age', '0'],
+    },
+    # no node is fast enough, so all speed tests run to the end and can be compared with the rates of the plan
+    "speed_test": {
+        "cluster": ['--nodes', '40', '--rate', '20e6', '--rate_spread', '0.8'],
+        "finder": ['--min_download_speed', '100000', '--measurement_time', '3'],
+    },
+    "download": {
+        "cluster": ['--nodes', '50', '--size', str(512 * 1024 * 1024), '--rate', '40e6', '--rate_spread', '0'],
+        "finder": ['--min_download_speed', '1'],
+    },
+}
+
+parser = argparse.ArgumentParser(description='Offline benchmarks of snapshot-finder against a fake cluster')
+parser.add_argument('scenarios', nargs='*',
+    help=f'Scenarios to run: {", ".join(SCENARIOS)}. Default: all of them')
+parser.add_argument('--repeat', default=1, type=int, help='Run every scenario several times and report the medians')
+parser.add_argument('--finder_args', default='', type=str, help='Extra arguments of snapshot-finder.py')
+parser.add_argument('--cluster_args', default='', type=str, help='Extra arguments of fake_cluster.py')
+parser.add_argument('--json', default=None, type=str, help='Save the results to this json file')
+
+
+def check_archive(path: Path, size: int) -> bool:
+    # fake_cluster.py serves bytes(range(251)) repeated
+    block_size = 251 * 4096
+    pattern = bytes(range(251)) * 4096
+    with open(path, 'rb') as archive_f:
+        for offset in range(0, size, block_size):
+            if archive_f.read(block_size) != pattern[:min(block_size, size - offset)]:
+                return False
+        return archive_f.read(1) == b''
+
+
+def load_json(path: Path, default):
+    try:
+        with open(path) as json_f:
+            return json.load(json_f)
+    except (OSError, ValueError):
+        return default
+
+
+def summarize(workdir: Path, wall_seconds: float) -> dict:
+    plan = load_json(workdir / 'plan.json', {"nodes": [], "size": 0})
+    snapshots = workdir / 'snapshots'
+    report = load_json(snapshots / 'run_report.json', {})
+    node_cache = load_json(snapshots / 'node_cache.json', {})
+    found = load_json(snapshots / 'snapshot.json', {})
+    phases = report.get("phases", {})
+    histograms = report.get("histograms", {})
+
+    probes = histograms.get("probe_seconds", {})
+    probe_count = sum(histogram["count"] for histogram in probes.values())
+    discovery = phases.get("discovery", 0)
+
+    # relative error of every speed test against the upload rate of the node in the plan
+    rates = {node["address"]: node["rate"] for node in plan["nodes"]}
+    errors = [abs(node["speed"] - rates[address]) / rates[address]
+              for address, node in node_cache.items() if "speed" in node and node["speed"] and address in rates]
+
+    downloads = histograms.get("download_seconds", {})
+    download_bytes = sum(report.get("counters", {}).get("download_bytes", {}).values())
+    download_seconds = sum(histogram["sum"] for histogram in downloads.values())
+    archives = [path for path in snapshots.glob('*snapshot-*.tar.zst')]
+
+    return {
+        "wall_seconds": wall_seconds,
+        "get_cluster_nodes_seconds": phases.get("cluster_nodes", 0),
+        "discovery_seconds": discovery,
+        "probes": probe_count,
+        "probes_per_second": probe_count / discovery if discovery else 0,
+        "probe_ok_mean_ms": 1000 * probes["result=ok"]["mean"] if "result=ok" in probes else 0,
+        "nodes_found": found.get("rpc_nodes_with_actual_snapshot", 0),
+        "nodes_ok_in_plan": sum(node["kind"] == 'ok' for node in plan["nodes"]),
+        "speed_test_seconds": phases.get("speed_test", 0),
+        "speed_tests": len(errors),
+        "speed_test_error_mean": statistics.mean(errors) if errors else 0,
+        "speed_test_error_max": max(errors) if errors else 0,
+        "download_seconds": phases.get("download", 0),
+        "download_mb_per_second": download_bytes / download_seconds / MB if download_seconds else 0,
+        "archives_downloaded": len(archives),
+        "archives_valid": sum(check_archive(path, plan["size"]) for path in archives),
+    }
+
+
+def run_scenario(name: str, cluster_args: list, finder_args: list) -> dict:
+    scenario = SCENARIOS[name]
+    with tempfile.TemporaryDirectory(prefix=f'snapshot-finder-{name}-') as tmp:
+        workdir = Path(tmp)
+        (workdir / 'snapshots').mkdir()
+        cluster = subprocess.Popen([sys.executable, str(FAKE_CLUSTER), '--plan', str(workdir / 'plan.json'),
+                                    *scenario["cluster"], *cluster_args], stdout=subprocess.PIPE, text=True)
+        try:
+            ready = json.loads(cluster.stdout.readline() or '{}')
+            if not ready.get("ready"):
+                raise RuntimeError('fake_cluster.py did not start')
+            start_time = time.monotonic()
+            subprocess.run([sys.executable, str(FINDER), '-r', ready["rpc"], '--snapshot_path',
+                            str(workdir / 'snapshots'), '--num_of_retries', '1', '--sleep', '0',
+                            *scenario["finder"], *finder_args],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=tmp)
+            wall_seconds = time.monotonic() - start_time
+        finally:
+            cluster.terminate()
+            cluster.wait()
+        return summarize(workdir, wall_seconds)
+
+
+def main():
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+    cluster_args = shlex.split(args.cluster_args)
+    finder_args = shlex.split(args.finder_args)
+    results = {}
+    for name in args.scenarios or list(SCENARIOS):
+        runs = []
+        for attempt in range(1, args.repeat + 1):
+            print(f'{name}: run {attempt}/{args.repeat}', file=sys.stderr, flush=True)
+            runs.append(run_scenario(name, cluster_args, finder_args))
+        results[name] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+        print(f'\n{name}')
+        for key, value in results[name].items():
+            print(f'  {key:<28} {value:>12.3f}' if isinstance(value, float) else f'  {key:<28} {value:>12}')
+
+    if args.json is not None:
+        with open(args.json, 'w') as json_f:
+            json.dump({"finder_args": finder_args, "cluster_args": cluster_args, "results": results}, json_f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
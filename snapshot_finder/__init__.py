@@ -0,0 +1,25 @@
+"""Finds rpc nodes of a solana cluster serving fresh snapshots and downloads the snapshots.
+snapshot-finder.py is the command line interface, the same can be done from python:
+
+    from snapshot_finder import Config, SnapshotScanner
+
+    with SnapshotScanner(Config(snapshot_path='/mnt/snapshots', max_snapshot_age=2000)) as scanner:
+        result = scanner.scan()
+        for node in result.rpc_nodes:
+            print(node.snapshot_address, node.slots_diff, node.latency, node.files_to_download)
+"""
+__version__ = '0.3.9'
+
+from .batch import BatchRunner
+from .config import Config
+from .daemon import SnapshotDaemon
+from .metrics import Metrics
+from .node_cache import NodeCache
+from .prefetch import Prefetcher
+from .records import NodeRecord, ScanResult
+from .scanner import SnapshotScanner
+from .storage import DiskSpaceError
+from .verify import ArchiveError
+
+__all__ = ['Config', 'SnapshotScanner', 'SnapshotDaemon', 'Prefetcher', 'BatchRunner', 'ScanResult', 'NodeRecord',
+           'NodeCache', 'Metrics', 'ArchiveError', 'DiskSpaceError']
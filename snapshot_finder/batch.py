@@ -0,0 +1,233 @@
+import dataclasses
+import json
+import logging
+import time
+import typing
+from pathlib import Path
+
+from .config import Config
+from .scanner import SnapshotScanner
+from .scoring import download_size
+from .storage import CLEANUP_POLICIES, DiskSpaceError
+
+logger = logging.getLogger(__name__)
+
+# settings of a process, not of a target
+PROCESS_FIELDS = ('daemon_listen', 'daemon_probe_rate', 'daemon_slot_interval', 'from_daemon', 'prefetch',
+                  'prefetch_max_speed', 'prefetch_keep', 'prefetch_disk_budget')
+
+
+def _check_type(name: str, value, annotation):
+    # the json types of the Config fields: int, float (an int is fine), str, bool, Optional[...] and List[str]
+    if typing.get_origin(annotation) is typing.Union:
+        if value is None:
+            return
+        annotation = [arg for arg in typing.get_args(annotation) if arg is not type(None)][0]
+    if typing.get_origin(annotation) is list:
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            raise ValueError(f'{name} must be a list of strings')
+        return
+    expected = (int, float) if annotation is float else (annotation,)
+    # bool is an int in python, but not in the config
+    if not isinstance(value, expected) or (isinstance(value, bool) and annotation is not bool):
+        raise ValueError(f'{name} must be {annotation.__name__}, not {type(value).__name__}')
+
+
+def check_config(config: Config):
+    """Checks what argparse checks on the command line. Raises ValueError"""
+    if config.cleanup not in CLEANUP_POLICIES:
+        raise ValueError(f'cleanup must be one of {", ".join(CLEANUP_POLICIES)}, not {config.cleanup!r}')
+    if config.cleanup == 'archive' and not config.archive_path:
+        raise ValueError('cleanup archive requires archive_path')
+
+
+def load_batch(path: str, defaults: Config) -> tuple:
+    """Configs of the targets of a batch file and the bandwidth budget of the batch (MB/s or None):
+
+        {"defaults": {"max_download_speed": 300},
+         "targets": [{"rpc_address": "https://api.mainnet-beta.solana.com", "snapshot_path": "/mnt/mainnet"},
+                     {"rpc_address": "https://api.testnet.solana.com", "snapshot_path": "/mnt/testnet",
+                      "wildcard_version": "2.0", "max_snapshot_age": 2000}]}
+
+    The keys are the fields of Config. A target takes the defaults of the file, then the defaults
+    (the command line options). max_download_speed of the defaults is the budget.
+    Raises ValueError if the file is invalid, OSError if it can't be read"""
+    with open(path) as batch_f:
+        batch = json.load(batch_f)
+    if not isinstance(batch, dict) or not isinstance(batch.get("targets"), list) or not batch["targets"]:
+        raise ValueError('the batch file must be a json object with a non-empty list of "targets"')
+
+    annotations = typing.get_type_hints(Config)
+    allowed = set(annotations) - set(PROCESS_FIELDS)
+    file_defaults = batch.get("defaults", {})
+    configs = []
+    for n, target in enumerate([file_defaults] + batch["targets"]):
+        if not isinstance(target, dict):
+            raise ValueError(f'target {n} is not a json object')
+        where = f'target {n}' if n > 0 else 'defaults'
+        unknown = set(target) - allowed
+        if unknown:
+            raise ValueError(f'{where}: unknown settings {", ".join(sorted(unknown))}')
+        for name, value in target.items():
+            try:
+                _check_type(name, value, annotations[name])
+            except ValueError as typeErr:
+                raise ValueError(f'{where}: {typeErr}')
+        if n > 0:
+            if "snapshot_path" not in target:
+                raise ValueError(f'target {n} has no snapshot_path')
+            # metrics_textfile of the command line is not inherited, its default is in the snapshot_path of the target
+            config = dataclasses.replace(defaults, **{"metrics_textfile": None, **file_defaults, **target})
+            try:
+                check_config(config)
+            except ValueError as configErr:
+                raise ValueError(f'target {n}: {configErr}')
+            configs.append(config)
+
+    paths = [config.snapshot_path for config in configs]
+    if len(set(paths)) != len(paths):
+        raise ValueError('several targets have the same snapshot_path')
+    return configs, file_defaults.get("max_download_speed", defaults.max_download_speed)
+
+
+def cluster_config(configs: list) -> Config:
+    """Config of the discovery shared by the targets of one cluster: the nodes are probed with the loosest
+    filters of the targets, every target checks the probes against its own filters"""
+    return dataclasses.replace(
+        configs[0], slot=0, version=None, wildcard_version=None, ip_blacklist=[], early_exit=0, warm_start=False,
+        max_snapshot_age=max(config.max_snapshot_age for config in configs),
+        max_latency=max(config.max_latency for config in configs),
+        with_private_rpc=any(config.with_private_rpc for config in configs),
+        threads_count=max(config.threads_count for config in configs))
+
+
+class BatchRunner:
+    """Downloads the snapshots of several targets (snapshot paths with their own filters, possibly of different
+    clusters) in one process. The targets of a cluster (the same rpc_address) share one getClusterNodes call
+    and one discovery pass, the keep-alive connections, the node cache and the metrics. The first target of
+    a cluster owns them: node_cache.json, run_report.json and the metrics textfile (its metrics_textfile) of
+    the cluster are written to its snapshot_path only, metrics_textfile of the other targets is not used.
+    The downloads run one after another, the targets that only need an incremental snapshot first, so that
+    the downloads do not compete for the network and max_download_speed of the defaults is the bandwidth
+    budget of the whole batch"""
+
+    def __init__(self, configs: list, max_download_speed: int = None):
+        self.clusters = {}
+        for config in configs:
+            if max_download_speed is not None:
+                config = dataclasses.replace(config, max_download_speed=min(
+                    config.max_download_speed or max_download_speed, max_download_speed))
+            self.clusters.setdefault(config.rpc_address, []).append(config)
+        # rpc address -> the scanner of the discovery and the scanners of the targets
+        self.scanners = {}
+
+    def open(self):
+        for rpc_address, configs in self.clusters.items():
+            for config in configs:
+                Path(config.snapshot_path).mkdir(parents=True, exist_ok=True)
+            cluster = SnapshotScanner(cluster_config(configs))
+            self.scanners[rpc_address] = (cluster, [SnapshotScanner(config, cluster) for config in configs])
+
+    def close(self):
+        for cluster, targets in self.scanners.values():
+            cluster.close()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def discover(self, cluster: SnapshotScanner) -> bool:
+        """One discovery pass over the cluster. Returns False if its rpc does not respond"""
+        if not cluster.update_current_slot():
+            return False
+        rpc_nodes = cluster.get_rpc_nodes()
+        if rpc_nodes is None:
+            return False
+        logger.info(f'{cluster.config.rpc_address}: RPC servers in total: {len(rpc_nodes)} | '
+                    f'Current slot number: {cluster.current_slot}\n')
+        cluster.probes = {}
+        cluster.result.rpc_nodes = []
+        cluster.probe_nodes(rpc_nodes)
+        return True
+
+    def schedule(self, targets: list) -> list:
+        """Targets in the order of their downloads: the least to download first, the nodes of every target
+        are taken from the discovery of its cluster"""
+        scheduled = []
+        for target in targets:
+            target.find_local_snapshot()
+            target.remove_stale_probes()
+            target.adopt_discovery(target.cluster)
+            best = target.result.rpc_nodes[0] if target.result.rpc_nodes else None
+            scheduled.append((download_size(best, target.full_local_snap_slot) if best is not None else 0, target))
+        return [target for size, target in sorted(scheduled, key=lambda item: item[0])]
+
+    def download(self, target: SnapshotScanner) -> bool:
+        """Speed tests the nodes found for the target and downloads its snapshots. Returns True if they were
+        downloaded. Raises DiskSpaceError, no other node helps then"""
+        logger.info(f'Downloading the snapshots of {target.config.snapshot_path} from {target.config.rpc_address}')
+        try:
+            return target.select_and_download() == 0
+
+        except DiskSpaceError:
+            raise
+
+        except Exception as workerErr:
+            logger.error(f'Exception in download() func of {target.config.snapshot_path}\n{workerErr}')
+            return False
+
+    def run(self) -> int:
+        """Downloads the snapshots of all targets, the targets left without a snapshot are retried up to
+        num_of_retries times of their cluster. Returns 0 if the snapshots of all targets were downloaded"""
+        pending = {rpc_address: list(targets) for rpc_address, (cluster, targets) in self.scanners.items()}
+        failed = {rpc_address: [] for rpc_address in self.scanners}
+        for cluster, targets in self.scanners.values():
+            cluster.metrics.set('last_run_success', 0)
+            cluster.metrics.set('last_run_timestamp_seconds', cluster.metrics.started_at)
+
+        attempts = max(cluster.config.num_of_retries for cluster, targets in self.scanners.values())
+        sleep = max(cluster.config.sleep for cluster, targets in self.scanners.values())
+        for attempt in range(1, attempts + 1):
+            ready = []
+            for rpc_address, targets in pending.items():
+                cluster = self.scanners[rpc_address][0]
+                if not targets or attempt > cluster.config.num_of_retries:
+                    continue
+                logger.info(f'{rpc_address}: attempt number: {attempt}. Total attempts: '
+                            f'{cluster.config.num_of_retries} | Targets left: {len(targets)}')
+                if self.discover(cluster):
+                    ready += targets
+                else:
+                    logger.error(f'Can\'t scan the cluster {rpc_address}')
+
+            for target in self.schedule(ready):
+                rpc_address = target.config.rpc_address
+                try:
+                    downloaded = self.download(target)
+                except DiskSpaceError as spaceErr:
+                    logger.error(f'Not enough disk space in {target.config.snapshot_path} --> skip the target\n'
+                                 f'{spaceErr}')
+                    pending[rpc_address].remove(target)
+                    failed[rpc_address].append(target)
+                    continue
+                target.metrics.inc('batch_targets', result='ok' if downloaded else 'failed')
+                if downloaded:
+                    pending[rpc_address].remove(target)
+
+            left = sum(map(len, pending.values()))
+            if not left or attempt == attempts:
+                break
+            logger.info(f'{left} targets are left without snapshots, sleeping {sleep} seconds')
+            time.sleep(sleep)
+
+        for rpc_address, (cluster, targets) in self.scanners.items():
+            failed[rpc_address] += pending[rpc_address]
+            cluster.metrics.set('last_run_success', int(not failed[rpc_address]))
+            cluster.metrics.set('batch_failed_targets', len(failed[rpc_address]))
+            cluster.save_metrics()
+            for target in failed[rpc_address]:
+                logger.error(f'No snapshot was downloaded to {target.config.snapshot_path}')
+        return 1 if any(failed.values()) else 0
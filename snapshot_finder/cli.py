@@ -0,0 +1,226 @@
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+
+from . import __version__
+from .batch import BatchRunner, load_batch
+from .config import Config
+from .daemon import SnapshotDaemon
+from .discovery import raise_open_files_limit
+from .scanner import SnapshotScanner
+from .scoring import EARLY_EXIT_MAX_SLOTS_DIFF
+
+logger = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser(description='Solana snapshot finder')
+parser.add_argument('-t', '--threads-count', default=1000, type=int,
+    help='the maximum number of concurrently running probes that check snapshots for rpc nodes. The number adapts '
+         'to the network: it is halved when the latency of the responses grows or timeouts burst')
+parser.add_argument('--probe_timeout', default=1, type=float,
+    help='Timeout in seconds for a single snapshot probe (connect + response headers) of one rpc node. Nodes that '
+         'timed out while the probes were congested or that responded in a previous run are probed again with '
+         'a 3 times longer timeout')
+parser.add_argument('-r', '--rpc_address',
+    default='https://api.mainnet-beta.solana.com', type=str,
+    help='RPC address of the node from which the current slot number will be taken\n'
+         'https://api.mainnet-beta.solana.com')
+
+parser.add_argument("--slot", default=0, type=int,
+                     help="search for a snapshot with a specific slot number (useful for network restarts)")
+parser.add_argument("--version", default=None, help="search for a snapshot from a specific version node")
+parser.add_argument("--wildcard_version", default=None, help="search for a snapshot with a major / minor version e.g. 1.18 (excluding .23)")
+parser.add_argument('--max_snapshot_age', default=1300, type=int, help='How many slots ago the snapshot was created (in slots)')
+parser.add_argument('--min_download_speed', default=60, type=int, help='Minimum average snapshot download speed in megabytes')
+parser.add_argument('--max_download_speed', type=int,
+help='Maximum snapshot download speed in megabytes - https://github.com/c29r3/solana-snapshot-finder/issues/11. Example: --max_download_speed 192')
+parser.add_argument('--download_connections', default=8, type=int,
+    help='The number of parallel connections (http range requests) used to download a snapshot')
+parser.add_argument('--swarm_sources', default=1, type=int,
+    help='The number of rpc nodes serving the same archive from which it is downloaded at once')
+parser.add_argument('--race_incremental', default=1, type=int,
+    help='Download the incremental snapshot from this many rpc nodes serving it at once and keep the copy that '
+         'finishes first, the other downloads are cancelled. 1 - download it from the chosen node only')
+parser.add_argument('--wget', action="store_true",
+    help='Download snapshots with wget over a single connection instead of the built-in downloader')
+parser.add_argument('--verify', action="store_true",
+    help='Decompress the archive and check its tar structure while it is downloaded. A corrupted archive is deleted '
+         'and the node that served it is skipped. .tar.zst and .tar.lz4 need the zstandard and lz4 packages')
+parser.add_argument('--max_latency', default=100, type=int, help='The maximum value of latency (milliseconds). If latency > max_latency --> skip')
+parser.add_argument('--with_private_rpc', action="store_true", help='Enable adding and checking RPCs with the --private-rpc option.This slow down checking and searching but potentially increases'
+                    ' the number of RPCs from which snapshots can be downloaded.')
+parser.add_argument('--pool_size', default=1000, type=int,
+    help='The maximum number of idle keep-alive connections to rpc nodes that are reused during the run')
+parser.add_argument('--pool_idle_timeout', default=30, type=float,
+    help='Idle keep-alive connections older than this value (seconds) are closed')
+parser.add_argument('--measurement_time', default=7, type=int, help='Time in seconds during which the script will measure the download speed')
+parser.add_argument('--tournament_size', default=1, type=int,
+    help='The number of rpc nodes whose download speed is measured at the same time, clearly slower nodes are '
+         'dropped early. 1 - measure the nodes one by one')
+parser.add_argument('--snapshot_path', type=str, default=".", help='The location where the snapshot will be downloaded (absolute path).'
+                                                                     ' Example: /home/ubuntu/solana/validator-ledger')
+parser.add_argument('--num_of_retries', default=5, type=int, help='The number of retries if a suitable server for downloading the snapshot was not found')
+parser.add_argument('--sleep', default=7, type=int, help='Sleep before next retry (seconds)')
+parser.add_argument('--warm_start', action="store_true",
+    help='Check the rpc nodes from the previous snapshot.json and new or changed gossip entries first, '
+         'the remaining nodes are checked only if none of them is suitable')
+parser.add_argument('--node_cache_ttl', default=21600, type=int,
+    help='How long (seconds) the latency, speed and failures of rpc nodes are remembered in node_cache.json '
+         'between runs. Nodes that failed recently are skipped, fast ones are checked first. 0 - disable')
+parser.add_argument('--sort_order', default='score', type=str,
+    help='Priority way to sort the found servers. latency, slots_diff or score - the expected time until the '
+         'validator is ready, estimated from the latency, the age of the snapshot, the download speed measured in '
+         'previous runs and whether the full snapshot is already on the local disk')
+parser.add_argument('--early_exit', default=0, type=int,
+    help=f'Stop searching once this many rpc nodes are found whose snapshot is at most {EARLY_EXIT_MAX_SLOTS_DIFF} '
+         'slots old and whose download speed measured in a previous run (node cache) is at least min_download_speed. '
+         'Fresher snapshots of the nodes that are not probed yet are missed then. 0 - always check all rpc nodes')
+parser.add_argument('--subnet_prefix', default=24, type=int,
+    help='Rpc nodes in the same /subnet_prefix ipv4 network are considered one group: one node of every group is '
+         'checked first and the other nodes of a group whose node was too slow are speed tested last. '
+         '0 - do not group by subnets')
+parser.add_argument('--asn_db', default=None, type=str,
+    help='Group the rpc nodes by autonomous systems instead of subnets. The path of an offline ip to asn database: '
+         'the ip2asn tsv file of https://iptoasn.com (plain or .gz)')
+parser.add_argument('-ipb', '--ip_blacklist', default='', type=str, help='Comma separated list of ip addresse (ip:port) that will be excluded from the scan. Example: -ipb 1.1.1.1:8899,8.8.8.8:8899')
+parser.add_argument('-b', '--blacklist', default='', type=str, help='If the same corrupted archive is constantly downloaded, you can exclude it.'
+                    ' Specify either the number of the slot you want to exclude, or the hash of the archive name. '
+                    'You can specify several, separated by commas. Example: -b 135501350,135501360 or --blacklist 135501350,some_hash')
+parser.add_argument('--metrics_textfile', default=None, type=str,
+    help='Where to write the metrics of the run in the Prometheus text format (for the node_exporter textfile '
+         'collector). Default: snapshot-finder.prom next to snapshot.json. The json report is run_report.json')
+parser.add_argument('--daemon', action="store_true",
+    help='Run forever and keep a rolling index of the snapshots served by the rpc nodes: getSlot is polled, the nodes '
+         'are probed again at --daemon_probe_rate and the best candidates are speed tested in advance. '
+         'The best nodes are served over http on --daemon_listen, nothing is downloaded '
+         'without --prefetch')
+parser.add_argument('--daemon_listen', default='127.0.0.1:8898', type=str,
+    help='host:port or the path of a unix socket on which the daemon serves /best, /snapshot.json, /snapshots '
+         'and /health')
+parser.add_argument('--daemon_probe_rate', default=50, type=float,
+    help='The maximum number of rpc nodes the daemon probes per second')
+parser.add_argument('--daemon_slot_interval', default=10, type=float,
+    help='How often (seconds) the daemon polls getSlot. Sweeps over the rpc nodes do not start more often either')
+parser.add_argument('--from_daemon', default=None, type=str,
+    help='Take the suitable rpc nodes from a daemon (its --daemon_listen address) and start downloading right away. '
+         'The cluster is scanned as usual if none of them works')
+parser.add_argument('--prefetch', action="store_true",
+    help='Together with --daemon: download the newest full snapshot of the cluster in the background as soon as it '
+         'appears, so that a restart only has to download the incremental snapshot')
+parser.add_argument('--prefetch_max_speed', default=50, type=int,
+    help='Download speed limit of the prefetch in megabytes. 0 - no limit')
+parser.add_argument('--prefetch_keep', default=2, type=int,
+    help='The number of full snapshots kept after a prefetch, older ones and their incremental snapshots are deleted')
+parser.add_argument('--prefetch_disk_budget', default=None, type=float,
+    help='The maximum size (gigabytes) of the full snapshots kept after a prefetch, the newest one is always kept')
+parser.add_argument('--cleanup', default='keep', choices=['keep', 'delete', 'archive'],
+    help='What happens to the local snapshots superseded by a downloaded one (older full snapshots and the '
+         'incremental snapshots based on them, older incremental snapshots): keep them, delete them or archive - '
+         'move them to --archive_path. With delete and archive they also make room for a download that does not fit')
+parser.add_argument('--archive_path', default=None, type=str,
+    help='Where --cleanup archive moves the superseded snapshots to')
+parser.add_argument('--batch', default=None, type=str,
+    help='Download the snapshots of several targets in one process. The path of a json file: {"defaults": {...}, '
+         '"targets": [{"rpc_address": ..., "snapshot_path": ..., "version": ..., "max_snapshot_age": ...}, ...]}, '
+         'the keys are the long options, the command line options are the defaults. The targets of one cluster share '
+         'the discovery and the connections, the downloads run one after another within --max_download_speed')
+parser.add_argument("-v", "--verbose", help="increase output verbosity to DEBUG", action="store_true")
+
+
+def make_config(args: argparse.Namespace) -> Config:
+    return Config(
+        rpc_address=args.rpc_address, snapshot_path=args.snapshot_path, slot=args.slot, version=args.version,
+        wildcard_version=args.wildcard_version, max_snapshot_age=args.max_snapshot_age,
+        min_download_speed=args.min_download_speed, max_download_speed=args.max_download_speed,
+        download_connections=args.download_connections, swarm_sources=args.swarm_sources,
+        race_incremental=args.race_incremental, wget=args.wget,
+        verify=args.verify, max_latency=args.max_latency, with_private_rpc=args.with_private_rpc,
+        threads_count=args.threads_count, probe_timeout=args.probe_timeout, pool_size=args.pool_size,
+        pool_idle_timeout=args.pool_idle_timeout, measurement_time=args.measurement_time,
+        tournament_size=args.tournament_size, num_of_retries=args.num_of_retries, sleep=args.sleep,
+        warm_start=args.warm_start, node_cache_ttl=args.node_cache_ttl, sort_order=args.sort_order,
+        early_exit=args.early_exit, subnet_prefix=args.subnet_prefix, asn_db=args.asn_db,
+        ip_blacklist=str(args.ip_blacklist).split(","), blacklist=str(args.blacklist).split(","),
+        metrics_textfile=args.metrics_textfile, daemon_listen=args.daemon_listen,
+        daemon_probe_rate=args.daemon_probe_rate, daemon_slot_interval=args.daemon_slot_interval,
+        from_daemon=args.from_daemon, prefetch=args.prefetch, prefetch_max_speed=args.prefetch_max_speed or None,
+        prefetch_keep=args.prefetch_keep, prefetch_disk_budget=args.prefetch_disk_budget, cleanup=args.cleanup,
+        archive_path=args.archive_path)
+
+
+def setup_logging(snapshot_path: str, verbose: bool):
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
+    logging.basicConfig(
+        level=logging.DEBUG if verbose else logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[
+            logging.FileHandler(f'{snapshot_path}/snapshot-finder.log'),
+            logging.StreamHandler(sys.stdout),
+        ]
+    )
+
+
+def main(argv: list = None) -> int:
+    args = parser.parse_args(argv)
+    if args.prefetch and not args.daemon:
+        parser.error('--prefetch works in the --daemon mode only')
+    if args.cleanup == 'archive' and not args.archive_path:
+        parser.error('--cleanup archive requires --archive_path')
+    if args.batch is not None and (args.daemon or args.from_daemon is not None):
+        parser.error('--batch does not work with --daemon and --from_daemon')
+    config = make_config(args)
+    if args.batch is not None:
+        try:
+            batch_configs, max_download_speed = load_batch(args.batch, config)
+        except (OSError, ValueError, TypeError) as batchErr:
+            parser.error(f'Can\'t load the batch file {args.batch}: {batchErr}')
+    setup_logging(config.snapshot_path, args.verbose)
+
+    logger.info(f"Version: {__version__}")
+    logger.info("https://github.com/c29r3/solana-snapshot-finder\n\n")
+    logger.info(f'RPC={config.rpc_address!r}\n'
+          f'MAX_SNAPSHOT_AGE_IN_SLOTS={config.max_snapshot_age}\n'
+          f'MIN_DOWNLOAD_SPEED_MB={config.min_download_speed}\n'
+          f'MAX_DOWNLOAD_SPEED_MB={config.max_download_speed}\n'
+          f'DOWNLOAD_CONNECTIONS={config.download_connections}\n'
+          f'SNAPSHOT_PATH={config.snapshot_path!r}\n'
+          f'THREADS_COUNT={config.threads_count}\n'
+          f'NUM_OF_MAX_ATTEMPTS={config.num_of_retries}\n'
+          f'WITH_PRIVATE_RPC={config.with_private_rpc}\n'
+          f'SORT_ORDER={config.sort_order!r}')
+
+    try:
+        f_ = open(f'{config.snapshot_path}/write_perm_test', 'w')
+        f_.close()
+        os.remove(f'{config.snapshot_path}/write_perm_test')
+    except IOError:
+        logger.error(f'\nCheck SNAPSHOT_PATH={config.snapshot_path!r} and permissions')
+        Path(config.snapshot_path).mkdir(parents=True, exist_ok=True)
+
+    raise_open_files_limit()
+    if args.batch is not None:
+        logger.info(f'Batch {args.batch!r}: {len(batch_configs)} targets')
+        try:
+            with BatchRunner(batch_configs, max_download_speed) as batch_runner:
+                return batch_runner.run()
+        except (RuntimeError, ValueError) as configErr:
+            logger.error(configErr)
+            return 1
+        except KeyboardInterrupt:
+            sys.exit('\nKeyboardInterrupt - ctrl + c')
+
+    try:
+        scanner = SnapshotScanner(config)
+    except RuntimeError as configErr:
+        logger.error(configErr)
+        return 1
+
+    try:
+        with scanner:
+            if args.daemon:
+                SnapshotDaemon(scanner).serve_forever()
+                return 0
+            return scanner.run()
+    except KeyboardInterrupt:
+        sys.exit('\nKeyboardInterrupt - ctrl + c')
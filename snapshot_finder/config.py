@@ -0,0 +1,65 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+
+@dataclass
+class Config:
+    """Settings of a SnapshotScanner, the defaults are the defaults of the command line options"""
+    rpc_address: str = 'https://api.mainnet-beta.solana.com'
+    snapshot_path: str = '.'
+    slot: int = 0
+    version: Optional[str] = None
+    wildcard_version: Optional[str] = None
+    max_snapshot_age: int = 1300
+    min_download_speed: int = 60
+    max_download_speed: Optional[int] = None
+    download_connections: int = 8
+    swarm_sources: int = 1
+    race_incremental: int = 1
+    wget: bool = False
+    verify: bool = False
+    max_latency: int = 100
+    with_private_rpc: bool = False
+    threads_count: int = 1000
+    probe_timeout: float = 1
+    pool_size: int = 1000
+    pool_idle_timeout: float = 30
+    measurement_time: int = 7
+    tournament_size: int = 1
+    num_of_retries: int = 5
+    sleep: int = 7
+    warm_start: bool = False
+    node_cache_ttl: int = 21600
+    sort_order: str = 'score'
+    early_exit: int = 0
+    subnet_prefix: int = 24
+    asn_db: Optional[str] = None
+    cleanup: str = 'keep'
+    archive_path: Optional[str] = None
+    ip_blacklist: List[str] = field(default_factory=list)
+    blacklist: List[str] = field(default_factory=list)
+    metrics_textfile: Optional[str] = None
+    daemon_listen: str = '127.0.0.1:8898'
+    daemon_probe_rate: float = 50
+    daemon_slot_interval: float = 10
+    from_daemon: Optional[str] = None
+    prefetch: bool = False
+    prefetch_max_speed: Optional[int] = 50
+    prefetch_keep: int = 2
+    prefetch_disk_budget: Optional[float] = None
+
+    def __post_init__(self):
+        self.snapshot_path = self.snapshot_path.rstrip('/') or '/'
+        self.download_connections = max(1, self.download_connections)
+        self.swarm_sources = max(1, self.swarm_sources)
+        self.race_incremental = max(1, self.race_incremental)
+        self.tournament_size = max(1, self.tournament_size)
+        self.prefetch_keep = max(1, self.prefetch_keep)
+        self.ip_blacklist = [address for address in self.ip_blacklist if address]
+        self.blacklist = [item for item in self.blacklist if item]
+        if self.metrics_textfile is None:
+            self.metrics_textfile = f'{self.snapshot_path}/snapshot-finder.prom'
+
+    @property
+    def min_download_speed_bytes(self) -> float:
+        return self.min_download_speed * 1e6
@@ -0,0 +1,350 @@
+import asyncio
+import http.client
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from requests.exceptions import RequestException
+
+from .discovery import probe_snapshot_locations
+from .prefetch import Prefetcher, local_full_snapshots
+from .records import ScanResult, snapshot_slot
+from .speedtest import convert_size, measure_speed
+
+logger = logging.getLogger(__name__)
+
+# how often the list of rpc nodes is taken from getClusterNodes again (seconds)
+DAEMON_NODES_INTERVAL = 600
+# candidates are speed tested again when their last measurement is older than this (seconds)
+DAEMON_SPEED_TEST_INTERVAL = 1800
+# the number of speed tests after every sweep
+DAEMON_SPEED_TESTS = 3
+
+
+def parse_address(address: str):
+    """(host, port) of host:port or the path of a unix socket"""
+    if '/' in address:
+        return address
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def incremental_base_slot(location: str):
+    """Slot of the full snapshot an incremental snapshot /incremental-snapshot-<base>-<slot>-<hash>... is based on"""
+    try:
+        return int(location.split("-")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def daemon_request(address: str, path: str, timeout: float = 5):
+    """GET request to a running daemon (host:port or a unix socket path), returns the parsed json body.
+    Raises OSError, http.client.HTTPException or ValueError"""
+    target = parse_address(address)
+    if isinstance(target, str):
+        conn = UnixHTTPConnection(target, timeout)
+    else:
+        conn = http.client.HTTPConnection(*target, timeout=timeout)
+    try:
+        conn.request('GET', path)
+        r = conn.getresponse()
+        body = r.read()
+        if r.status != 200:
+            raise ValueError(f'{path} responded with {r.status} {body[:200]}')
+        return json.loads(body)
+    finally:
+        conn.close()
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """GET /best, /snapshot.json, /snapshots and /health. ?full_slot=<slot> - the slot of the full snapshot
+    the client already has, so that its incremental snapshot is enough"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        full_slot = parse_qs(url.query).get('full_slot', [None])[0]
+        snapshot_daemon = self.server.snapshot_daemon
+        if url.path == '/best':
+            best = snapshot_daemon.best(full_slot)
+            if best is None:
+                self._send(404, {"error": "no suitable snapshot node is known yet"})
+            else:
+                self._send(200, best)
+        elif url.path == '/snapshot.json':
+            self._send(200, snapshot_daemon.candidates(full_slot).to_dict())
+        elif url.path == '/snapshots':
+            self._send(200, snapshot_daemon.snapshots())
+        elif url.path == '/health':
+            self._send(200, snapshot_daemon.status())
+        else:
+            self._send(404, {"error": f'unknown path {url.path}'})
+
+    def _send(self, status: int, body: dict):
+        content = json.dumps(body, indent=2).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logger.debug(f'daemon http request: {format % args}')
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(address: str, snapshot_daemon: 'SnapshotDaemon'):
+    target = parse_address(address)
+    if isinstance(target, str):
+        if os.path.exists(target):
+            os.remove(target)
+        server = UnixHTTPServer(target, DaemonRequestHandler)
+    else:
+        server = ThreadingHTTPServer(target, DaemonRequestHandler)
+    server.snapshot_daemon = snapshot_daemon
+    return server
+
+
+class SnapshotDaemon:
+    """Keeps a rolling index of the snapshots served by the rpc nodes of the cluster.
+    getSlot is polled every config.daemon_slot_interval seconds, the nodes are probed again and again at no more than
+    config.daemon_probe_rate probes per second and the best candidates are speed tested in the background.
+    The index and the best candidates are served over http on config.daemon_listen, a restart takes them with
+    snapshot-finder.py --from_daemon and starts downloading right away.
+    With config.prefetch the newest full snapshot is downloaded in the background as well, see Prefetcher.
+    scanner - SnapshotScanner whose connections, node cache and filters are used"""
+
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.config = scanner.config
+        # rpc_address -> {"incremental": (location, latency) or None, "full": ..., "updated_at": time}
+        self.index = {}
+        self.lock = threading.Lock()
+        self.rpc_nodes = []
+        self.rpc_nodes_at = 0
+        self.sweeps = 0
+        self.last_sweep_at = 0.0
+        self.prefetcher = Prefetcher(scanner) if self.config.prefetch else None
+
+    def candidates(self, full_local_snap_slot=None) -> ScanResult:
+        """Nodes serving suitable snapshots at the current slot, the best one first.
+        full_local_snap_slot - see SnapshotScanner.make_record()"""
+        scanner = self.scanner
+        with self.lock:
+            entries = list(self.index.items())
+        rpc_nodes = []
+        for rpc_address, entry in entries:
+            if scanner.node_cache.is_bad(rpc_address) or scanner.node_cache.is_slow(rpc_address):
+                continue
+            rpc_node, _ = scanner.make_record(rpc_address, entry["incremental"], entry["full"], full_local_snap_slot)
+            if rpc_node is not None and not scanner.is_blacklisted(rpc_node):
+                rpc_nodes.append(rpc_node)
+        if self.config.sort_order == 'score':
+            # the score takes the measured speed into account already
+            rpc_nodes.sort(key=lambda node: node.score)
+        else:
+            # measured fast nodes first, then by --sort_order
+            rpc_nodes.sort(key=lambda node: (scanner.node_cache.priority(node.snapshot_address),
+                                             getattr(node, self.config.sort_order)))
+        return ScanResult(self.last_sweep_at, scanner.current_slot, len(self.rpc_nodes), rpc_nodes,
+                          dict(scanner.cluster_versions))
+
+    def best(self, full_local_snap_slot=None):
+        result = self.candidates(full_local_snap_slot)
+        if not result.rpc_nodes:
+            return None
+        rpc_node = result.rpc_nodes[0]
+        best = rpc_node.to_dict()
+        best.update({
+            "current_slot": result.last_update_slot,
+            "speed": self.scanner.node_cache.speed(rpc_node.snapshot_address),
+            "urls": [f'http://{rpc_node.snapshot_address}{path}' for path in rpc_node.files_to_download],
+        })
+        return best
+
+    def snapshots(self) -> dict:
+        """Which nodes serve which full and incremental snapshots, the newest snapshots first"""
+        full, incremental = {}, {}
+        with self.lock:
+            entries = list(self.index.items())
+        for rpc_address, entry in entries:
+            for probe, archives in ((entry["full"], full), (entry["incremental"], incremental)):
+                if probe is not None:
+                    archives.setdefault(probe[0], []).append(rpc_address)
+
+        def ordered(archives: dict) -> list:
+            return [{"slot": snapshot_slot(location), "location": location, "nodes": sorted(nodes)}
+                    for location, nodes in sorted(archives.items(), key=lambda item: snapshot_slot(item[0]) or 0,
+                                                  reverse=True)]
+
+        # an incremental snapshot is covered if its base full snapshot is on the local disk
+        local_full_slots = {slot for slot, path in local_full_snapshots(self.config.snapshot_path)}
+        incremental = ordered(incremental)
+        for snapshot in incremental:
+            snapshot["base_slot"] = incremental_base_slot(snapshot["location"])
+            snapshot["covered"] = snapshot["base_slot"] in local_full_slots
+        return {"current_slot": self.scanner.current_slot, "updated_at": self.last_sweep_at,
+                "local_full_slots": sorted(local_full_slots, reverse=True), "full": ordered(full),
+                "incremental": incremental}
+
+    def covered_nodes(self) -> int:
+        """The number of nodes serving an incremental snapshot based on a local full snapshot"""
+        local_full_slots = {slot for slot, path in local_full_snapshots(self.config.snapshot_path)}
+        with self.lock:
+            return sum(entry["incremental"] is not None
+                       and incremental_base_slot(entry["incremental"][0]) in local_full_slots
+                       for entry in self.index.values())
+
+    def status(self) -> dict:
+        with self.lock:
+            indexed_nodes = len(self.index)
+        status = {"current_slot": self.scanner.current_slot, "last_sweep_at": self.last_sweep_at, "sweeps": self.sweeps,
+                  "rpc_nodes": len(self.rpc_nodes), "indexed_nodes": indexed_nodes, "covered_nodes": self.covered_nodes()}
+        if self.prefetcher is not None:
+            status["prefetch"] = self.prefetcher.status()
+        return status
+
+    def set_rpc_nodes(self, rpc_nodes: list):
+        # nodes that left the cluster are forgotten
+        with self.lock:
+            for rpc_address in set(self.index) - set(rpc_nodes):
+                del self.index[rpc_address]
+        self.rpc_nodes = rpc_nodes
+        self.rpc_nodes_at = time.monotonic()
+
+    async def _refresh_node(self, rpc_address: str, semaphore: asyncio.Semaphore):
+        scanner = self.scanner
+        async with semaphore:
+            inc_probe, full_probe = await probe_snapshot_locations(
+                scanner.connection_pool, scanner.metrics, rpc_address,
+                ['/incremental-snapshot.tar.bz2', '/snapshot.tar.bz2'], self.config.probe_timeout)
+        scanner.record_probe(rpc_address, inc_probe, full_probe)
+        with self.lock:
+            if inc_probe is None and full_probe is None:
+                self.index.pop(rpc_address, None)
+            else:
+                self.index[rpc_address] = {"incremental": inc_probe, "full": full_probe, "updated_at": time.time()}
+
+    async def _sweep(self, rpc_nodes: list):
+        # probes are started at no more than daemon_probe_rate per second, so the daemon does not load the network
+        # the way a one-off scan does
+        semaphore = asyncio.Semaphore(self.config.threads_count)
+        probes = []
+        for rpc_address in rpc_nodes:
+            probes.append(asyncio.ensure_future(self._refresh_node(rpc_address, semaphore)))
+            await asyncio.sleep(1 / self.config.daemon_probe_rate)
+        await asyncio.gather(*probes)
+
+    async def _poll_slot(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await loop.run_in_executor(None, self.scanner.update_current_slot)
+            await asyncio.sleep(self.config.daemon_slot_interval)
+
+    def speed_test_candidates(self):
+        # the best candidates are measured in advance, a restart should not wait for speed tests
+        scanner = self.scanner
+        tested = 0
+        for rpc_node in self.candidates().rpc_nodes:
+            if tested >= DAEMON_SPEED_TESTS:
+                break
+            cached = scanner.node_cache.nodes.get(rpc_node.snapshot_address, {})
+            if time.time() - cached.get("speed_at", 0) < DAEMON_SPEED_TEST_INTERVAL:
+                continue
+            tested += 1
+            try:
+                speed = measure_speed(scanner.session, rpc_node.snapshot_address, self.config.measurement_time)
+            except (RequestException, OSError) as speedErr:
+                logger.debug(f'Speed test of {rpc_node.snapshot_address} failed {speedErr}')
+                scanner.node_cache.record_probe(rpc_node.snapshot_address)
+                continue
+            scanner.record_speed_test(rpc_node, speed)
+            logger.info(f'Speed test of {rpc_node.snapshot_address}: {convert_size(speed)}/s')
+
+    def save(self):
+        scanner = self.scanner
+        result = self.candidates()
+        scanner.result = result
+        result.save(scanner.result_path)
+        scanner.node_cache.save()
+        scanner.connection_pool.evict_idle()
+        scanner.metrics.set('daemon_indexed_nodes', len(self.index))
+        scanner.metrics.set('daemon_candidates', len(result.rpc_nodes))
+        scanner.metrics.set('daemon_last_sweep_timestamp_seconds', self.last_sweep_at)
+        covered_nodes = self.covered_nodes()
+        scanner.metrics.set('daemon_covered_nodes', covered_nodes)
+        scanner.save_metrics()
+        best = result.rpc_nodes[0] if result.rpc_nodes else None
+        logger.info(f'Sweep {self.sweeps}: slot {scanner.current_slot}, {len(self.index)} rpc nodes serve snapshots, '
+                    f'{len(result.rpc_nodes)} are suitable, {covered_nodes} serve an incremental snapshot of a local '
+                    f'full snapshot. Best: {best}')
+        if self.prefetcher is not None:
+            # the full snapshots of all candidates, also of those whose incremental snapshot is covered already
+            self.prefetcher.maybe_start(self.candidates(full_local_snap_slot=0))
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        poller = asyncio.ensure_future(self._poll_slot())
+        try:
+            while True:
+                start_time = time.monotonic()
+                # a failed iteration (a full disk, an unexpected answer) must not stop the daemon and its index
+                try:
+                    if not self.rpc_nodes or start_time - self.rpc_nodes_at > DAEMON_NODES_INTERVAL:
+                        rpc_nodes = await loop.run_in_executor(None, self.scanner.get_rpc_nodes)
+                        if rpc_nodes is not None:
+                            self.set_rpc_nodes(rpc_nodes)
+                    await loop.run_in_executor(None, self.scanner.find_local_snapshot, False)
+
+                    with self.scanner.metrics.timer('daemon_sweep_seconds'):
+                        await self._sweep(self.rpc_nodes)
+                    self.sweeps += 1
+                    self.last_sweep_at = time.time()
+                    await loop.run_in_executor(None, self.speed_test_candidates)
+                    await loop.run_in_executor(None, self.save)
+                except Exception:
+                    self.scanner.metrics.inc('daemon_errors')
+                    logger.exception(f'Exception in the daemon loop --> retrying after '
+                                     f'{self.config.daemon_slot_interval} seconds')
+                await asyncio.sleep(max(0.0, self.config.daemon_slot_interval - (time.monotonic() - start_time)))
+        finally:
+            poller.cancel()
+
+    def serve_forever(self):
+        server = make_server(self.config.daemon_listen, self)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f'Daemon mode: the best snapshot nodes are served on {self.config.daemon_listen} '
+                    f'(/best, /snapshot.json, /snapshots, /health)')
+        event_loop = self.scanner.event_loop
+        try:
+            event_loop.run_until_complete(self._run())
+        finally:
+            # ctrl + c interrupts the loop in the middle of a sweep, the pending probes are cancelled
+            tasks = asyncio.all_tasks(event_loop)
+            for task in tasks:
+                task.cancel()
+            event_loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            server.shutdown()
+            server.server_close()
+            if isinstance(parse_address(self.config.daemon_listen), str):
+                os.remove(self.config.daemon_listen)
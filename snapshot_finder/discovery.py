@@ -0,0 +1,277 @@
+import asyncio
+import collections
+import logging
+import time
+
+from .metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# AdaptiveLimiter: the limit of probes in flight starts at this value (or at the maximum if it is lower)
+# and never goes below PROBES_MIN_LIMIT
+PROBES_INITIAL_LIMIT = 100
+PROBES_MIN_LIMIT = 16
+# the outcome of a window of at least this many probes decides whether the limit grows or shrinks
+PROBES_MIN_WINDOW = 32
+# congestion: the median latency of the answered probes grows beyond this factor of its moving average ...
+LATENCY_INFLATION = 2
+# ... or the share of timeouts exceeds its moving average by this much while the latency grows too
+TIMEOUT_RATE_MARGIN = 0.2
+
+
+class PooledConnection:
+    __slots__ = ('reader', 'writer', 'reused', 'last_used')
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.reused = False
+        self.last_used = time.monotonic()
+
+    def is_alive(self, idle_timeout: float) -> bool:
+        return time.monotonic() - self.last_used < idle_timeout \
+            and not self.reader.at_eof() and not self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncConnectionPool:
+    """Keep-alive connections to rpc nodes, shared by all probes of the run.
+    The pool is bounded by the total number of idle connections (the least recently used hosts are evicted first)
+    and by the number of idle connections per host. Connections idle longer than idle_timeout are closed"""
+
+    def __init__(self, max_size: int, idle_timeout: float, max_per_host: int = 2):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_per_host = max_per_host
+        self.size = 0
+        # rpc_address -> idle connections, ordered from the least to the most recently used host
+        self.idle = collections.OrderedDict()
+
+    def _pop(self, rpc_address: str) -> PooledConnection:
+        conns = self.idle[rpc_address]
+        conn = conns.pop()
+        if not conns:
+            del self.idle[rpc_address]
+        self.size -= 1
+        return conn
+
+    async def acquire(self, rpc_address: str) -> PooledConnection:
+        while rpc_address in self.idle:
+            conn = self._pop(rpc_address)
+            if conn.is_alive(self.idle_timeout):
+                conn.reused = True
+                return conn
+            conn.close()
+
+        host, _, port = rpc_address.rpartition(':')
+        reader, writer = await asyncio.open_connection(host, int(port))
+        return PooledConnection(reader, writer)
+
+    def release(self, rpc_address: str, conn: PooledConnection):
+        conns = self.idle.setdefault(rpc_address, [])
+        self.idle.move_to_end(rpc_address)
+        if len(conns) >= self.max_per_host:
+            conn.close()
+            return
+
+        conn.last_used = time.monotonic()
+        conns.append(conn)
+        self.size += 1
+        while self.size > self.max_size:
+            self._pop(next(iter(self.idle))).close()
+
+    def evict_idle(self):
+        for rpc_address in list(self.idle):
+            alive = []
+            for conn in self.idle[rpc_address]:
+                if conn.is_alive(self.idle_timeout):
+                    alive.append(conn)
+                else:
+                    conn.close()
+                    self.size -= 1
+
+            if alive:
+                self.idle[rpc_address] = alive
+            else:
+                del self.idle[rpc_address]
+
+    def close(self):
+        for conns in self.idle.values():
+            for conn in conns:
+                conn.close()
+        self.idle.clear()
+        self.size = 0
+
+
+class AdaptiveLimiter:
+    """AIMD limit of the probes in flight (async with limiter: ...). Every window of finished probes without
+    congestion raises the limit: it doubles until the first congestion (slow start), then grows by a tenth.
+    A congested window halves it, the next window is not judged. Congestion is the median latency of the answered probes growing beyond
+    LATENCY_INFLATION times its moving average, or a burst of timeouts together with a growing latency.
+    Closed and firewalled nodes time out at any rate and do not slow the probes down"""
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max(1, max_limit)
+        self.limit = min(PROBES_INITIAL_LIMIT, self.max_limit)
+        self.in_flight = 0
+        self.slow_start = True
+        # the window after a decrease still holds probes started at the previous limit, it is not judged
+        self.recovering = False
+        # monotonic times at which the limit was halved
+        self.congestion_times = []
+        self.window = []
+        self.latency = None
+        self.timeout_rate = None
+        self._condition = None
+
+    async def __aenter__(self):
+        if self._condition is None:
+            # created in the running event loop
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify(max(1, self.limit - self.in_flight))
+
+    def congested_since(self, when: float) -> bool:
+        """Whether the limit was halved after the monotonic time when"""
+        return bool(self.congestion_times) and self.congestion_times[-1] >= when
+
+    def record(self, timed_out: bool, latency: float = None):
+        """Outcome of a finished probe: timed out or answered after latency seconds (None - failed otherwise)"""
+        self.window.append((timed_out, latency))
+        if len(self.window) < max(PROBES_MIN_WINDOW, self.limit):
+            return
+        window, self.window = self.window, []
+
+        timeout_rate = sum(timed_out for timed_out, latency in window) / len(window)
+        latencies = sorted(latency for timed_out, latency in window if latency is not None)
+        median_latency = latencies[len(latencies) // 2] if latencies else None
+        inflation = median_latency / self.latency if median_latency is not None and self.latency else 1
+        congested = inflation > LATENCY_INFLATION or \
+            (self.timeout_rate is not None and timeout_rate > self.timeout_rate + TIMEOUT_RATE_MARGIN and inflation > 1)
+        # the moving averages follow the mix of probed nodes
+        self.timeout_rate = timeout_rate if self.timeout_rate is None else 0.8 * self.timeout_rate + 0.2 * timeout_rate
+        if median_latency is not None:
+            self.latency = median_latency if self.latency is None else 0.8 * self.latency + 0.2 * median_latency
+
+        if self.recovering:
+            self.recovering = False
+        elif congested:
+            self.slow_start = False
+            self.recovering = True
+            self.congestion_times.append(time.monotonic())
+            self.limit = max(min(PROBES_MIN_LIMIT, self.max_limit), self.limit // 2)
+            logger.debug(f'Probes are congested ({timeout_rate=:.2f}, {median_latency=}) --> limit {self.limit}')
+        elif self.slow_start:
+            self.limit = min(self.max_limit, self.limit * 2)
+        else:
+            self.limit = min(self.max_limit, self.limit + max(1, self.limit // 10))
+
+
+def parse_head_response(raw_headers: bytes):
+    status_line, *header_lines = raw_headers.decode('latin-1').split('\r\n')
+    status_code = int(status_line.split()[1])
+    headers = {}
+    for line in header_lines:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    keep_alive = status_line.startswith('HTTP/1.1') and headers.get('connection', '').lower() != 'close'
+    return status_code, headers, keep_alive
+
+
+async def head_request(pool: AsyncConnectionPool, rpc_address: str, paths: list, retry: bool = True):
+    """Pipelined HTTP HEAD requests over one pooled keep-alive connection.
+    Returns [(status_code, headers, latency in ms)] in the order of paths.
+    The latency includes the tcp connect if a new connection is opened, like the latency of requests"""
+    start_time = time.monotonic()
+    conn = await pool.acquire(rpc_address)
+    responses = []
+    keep_alive = True
+    try:
+        conn.writer.write(b''.join(f'HEAD {path} HTTP/1.1\r\nHost: {rpc_address}\r\n\r\n'.encode() for path in paths))
+        await conn.writer.drain()
+        for _ in paths:
+            raw_headers = await conn.reader.readuntil(b'\r\n\r\n')
+            status_code, headers, keep_alive_ = parse_head_response(raw_headers)
+            responses.append((status_code, headers, (time.monotonic() - start_time) * 1000))
+            keep_alive = keep_alive and keep_alive_
+            if not keep_alive:
+                break
+
+    except (OSError, asyncio.IncompleteReadError):
+        conn.close()
+        # the server has closed an idle keep-alive connection or does not support pipelining
+        if retry and (conn.reused or responses):
+            return responses + await head_request(pool, rpc_address, paths[len(responses):], retry=False)
+        raise
+
+    except BaseException:
+        conn.close()
+        raise
+
+    if keep_alive:
+        pool.release(rpc_address, conn)
+    else:
+        conn.close()
+        if len(responses) < len(paths):
+            return responses + await head_request(pool, rpc_address, paths[len(responses):], retry=False)
+    return responses
+
+
+async def probe_snapshot_locations(pool: AsyncConnectionPool, metrics: Metrics, rpc_address: str, paths: list,
+                                   timeout_: float, limiter: AdaptiveLimiter = None, final: bool = True):
+    """Returns (location, latency) of the snapshot redirect or None for every path.
+    limiter - AdaptiveLimiter the outcome is reported to. final=False - the node is probed again with a longer
+    timeout if this probe times out: None is returned and the node is not counted as discarded yet"""
+    start_time = time.monotonic()
+    try:
+        responses = await asyncio.wait_for(head_request(pool, rpc_address, paths), timeout=timeout_)
+    except asyncio.TimeoutError:
+        metrics.observe('probe_seconds', time.monotonic() - start_time, result='timeout')
+        if limiter is not None:
+            limiter.record(timed_out=True)
+        if not final:
+            return None
+        metrics.inc('discarded', len(paths), reason='timeout')
+        return [None] * len(paths)
+    except (OSError, asyncio.IncompleteReadError):
+        # refused or reset connections are no sign of congestion
+        metrics.inc('discarded', len(paths), reason='timeout')
+        metrics.observe('probe_seconds', time.monotonic() - start_time, result='timeout')
+        if limiter is not None:
+            limiter.record(timed_out=False)
+        return [None] * len(paths)
+    except Exception as unknwErr:
+        metrics.inc('discarded', len(paths), reason='unknw_err')
+        metrics.observe('probe_seconds', time.monotonic() - start_time, result='error')
+        logger.debug(f'error in probe_snapshot_locations(): {unknwErr}')
+        if limiter is not None:
+            limiter.record(timed_out=False)
+        return [None] * len(paths)
+
+    metrics.observe('probe_seconds', time.monotonic() - start_time, result='ok')
+    if limiter is not None:
+        limiter.record(timed_out=False, latency=time.monotonic() - start_time)
+
+    return [(headers['location'], latency) if 'location' in headers else None
+            for status_code, headers, latency in responses]
+
+
+def raise_open_files_limit():
+    # every probed node keeps a socket in the pool, the default soft limit (1024) is too small for the default --threads-count
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        target = hard if hard != resource.RLIM_INFINITY else 65536
+        if target > soft:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ImportError, ValueError, OSError) as limitErr:
+        logger.debug(f'Can\'t raise the open files limit {limitErr}')
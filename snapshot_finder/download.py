@@ -0,0 +1,628 @@
+import collections
+import json
+import logging
+import math
+import os
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_EXCEPTION
+from urllib.parse import urlparse
+
+import requests
+from requests import HTTPError
+from requests.exceptions import RequestException
+from tqdm import tqdm
+
+from .speedtest import ProbeStream, convert_size
+from .storage import Storage, preallocate
+from .verify import ArchiveError, ArchiveVerifier, make_verifier, verify_file, verify_segments
+
+logger = logging.getLogger(__name__)
+
+MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_SEGMENT_RETRIES = 5
+SOURCE_MAX_FAILURES = 3
+# a source slower than this fraction of the best one gives its segments away
+SLOW_SOURCE_RATIO = 0.25
+PROGRESS_SAVE_INTERVAL = 5
+# an idle worker takes over the second half of the largest segment in flight if that half is at least this large
+STEAL_MIN_SIZE = 4 * 1024 * 1024
+# received data is written in pieces of this size at offsets aligned to it, segments are aligned to it as well.
+# Larger writes leave the cpu cache and are slower on the page cache
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+class RateLimiter:
+    """Token bucket shared by all connections of a download"""
+
+    def __init__(self, bytes_per_second: float):
+        self.rate = bytes_per_second
+        self.tokens = 0.0
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount: int):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last_time) * self.rate)
+            self.last_time = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+def split_into_segments(size: int, connections: int) -> list:
+    # more segments than connections, so that fast connections take over the work of slow ones
+    segment_size = max(MIN_SEGMENT_SIZE, math.ceil(size / (connections * 4 * WRITE_BUFFER_SIZE)) * WRITE_BUFFER_SIZE)
+    return [{"start": start, "end": min(start + segment_size, size) - 1, "done": 0}
+            for start in range(0, size, segment_size)]
+
+
+def load_progress(progress_fname: str, fname: str, size: int):
+    # the archive name contains the slot and the hash, so the progress is valid for any node serving the same file
+    try:
+        with open(progress_fname) as progress_f:
+            progress = json.load(progress_f)
+        if progress["name"] == fname and progress["size"] == size:
+            return progress["segments"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def save_progress(progress_fname: str, fname: str, size: int, segments: list, lock: threading.Lock):
+    with lock:
+        progress = {"name": fname, "size": size, "segments": [dict(segment) for segment in segments]}
+    with open(f'{progress_fname}.new', "w") as progress_f:
+        json.dump(progress, progress_f)
+    os.replace(f'{progress_fname}.new', progress_fname)
+
+
+class DownloadSource:
+    """One node serving the archive. rate - recent per-connection throughput (bytes/s)"""
+    __slots__ = ('url', 'session', 'rate', 'failures', 'active')
+
+    def __init__(self, url: str, session: requests.Session):
+        self.url = url
+        self.session = session
+        self.rate = None
+        self.failures = 0
+        self.active = 0
+
+
+class SegmentScheduler:
+    """Hands out pending segments to download workers and picks the source for each one.
+    Sources that have not been measured yet are tried first, then the one with the best per-connection rate wins.
+    A source failing SOURCE_MAX_FAILURES times in a row is dropped.
+    Once no segment is pending, an idle worker splits the largest segment in flight and takes its second half,
+    so the tail of the download does not run on a single connection"""
+
+    def __init__(self, segments: list, sources: list, lock: threading.Lock):
+        self.segments = segments
+        self.pending = [segment for segment in segments if segment["done"] < segment["end"] - segment["start"] + 1]
+        # segments handed out by next_job() and not released yet
+        self.in_flight = []
+        self.sources = sources
+        self.lock = lock
+        self.attempts = collections.Counter()
+
+    def _score(self, source: DownloadSource):
+        if source.rate is None:
+            return float('inf') if source.active == 0 else 0
+        return source.rate
+
+    def _split(self):
+        # the worker of a segment may hold a chunk and an unwritten buffer beyond segment["done"],
+        # the split point is past them and aligned like the segments
+        best, best_split, best_size = None, None, STEAL_MIN_SIZE - 1
+        for segment in self.in_flight:
+            offset = segment["start"] + segment["done"] + DOWNLOAD_CHUNK_SIZE + 2 * WRITE_BUFFER_SIZE
+            split = math.ceil((offset + segment["end"] + 1) / 2 / WRITE_BUFFER_SIZE) * WRITE_BUFFER_SIZE
+            if split > offset and segment["end"] + 1 - split > best_size:
+                best, best_split, best_size = segment, split, segment["end"] + 1 - split
+        if best is None:
+            return None
+        # the worker of the segment stops at its new end
+        stolen = {"start": best_split, "end": best["end"], "done": 0}
+        best["end"] = best_split - 1
+        self.segments.insert(self.segments.index(best) + 1, stolen)
+        logger.debug(f'Splitting segment {best["start"]}-{stolen["end"]} at {best_split}')
+        return stolen
+
+    def next_job(self):
+        with self.lock:
+            if not self.sources:
+                return None
+            segment = self.pending.pop(0) if self.pending else self._split()
+            if segment is None:
+                return None
+            source = max(self.sources, key=self._score)
+            source.active += 1
+            self.in_flight.append(segment)
+            return segment, source
+
+    def report(self, source: DownloadSource, loaded: int, seconds: float):
+        with self.lock:
+            rate = loaded / seconds
+            source.rate = rate if source.rate is None else 0.7 * source.rate + 0.3 * rate
+            source.failures = 0
+
+    def is_slow(self, source: DownloadSource) -> bool:
+        with self.lock:
+            rates = [s.rate for s in self.sources if s is not source and s.rate is not None]
+            return source.rate is not None and bool(rates) and source.rate < SLOW_SOURCE_RATIO * max(rates)
+
+    def release(self, segment: dict, source: DownloadSource, finished: bool):
+        with self.lock:
+            source.active -= 1
+            self.in_flight.remove(segment)
+            if not finished:
+                self.pending.append(segment)
+
+    def claim(self, offset: int):
+        """Takes the pending segment that continues exactly at offset, if there is one"""
+        with self.lock:
+            for segment in self.pending:
+                if segment["start"] + segment["done"] == offset:
+                    self.pending.remove(segment)
+                    return segment
+            return None
+
+    def requeue(self, segment: dict):
+        with self.lock:
+            self.pending.append(segment)
+
+    def fail(self, segment: dict, source: DownloadSource):
+        with self.lock:
+            source.active -= 1
+            self.in_flight.remove(segment)
+            source.failures += 1
+            if source.failures >= SOURCE_MAX_FAILURES and source in self.sources:
+                logger.info(f'Dropping the download source {source.url}')
+                self.sources.remove(source)
+            self.attempts[segment["start"]] += 1
+            if self.attempts[segment["start"]] > DOWNLOAD_SEGMENT_RETRIES * max(1, len(self.sources)) \
+                    or not self.sources:
+                raise IOError(f'Can\'t download segment {segment["start"]}-{segment["end"]}')
+            self.pending.append(segment)
+
+
+class SegmentWriter:
+    """Collects the data received for a segment into large writes at offsets aligned to WRITE_BUFFER_SIZE.
+    segment["done"] counts the written bytes only, so the saved progress never covers data lost in the buffer"""
+
+    def __init__(self, fd: int, segment: dict, lock: threading.Lock):
+        self.fd = fd
+        self.segment = segment
+        self.lock = lock
+        # the received chunks are written with a single pwritev() without copying them
+        self.chunks = []
+        self.used = 0
+
+    def write(self, chunk: bytes):
+        chunk = memoryview(chunk)
+        while chunk:
+            offset = self.segment["start"] + self.segment["done"]
+            # the first write ends at an aligned offset, the next ones are whole buffers
+            space = WRITE_BUFFER_SIZE - offset % WRITE_BUFFER_SIZE - self.used
+            part = chunk[:space]
+            self.chunks.append(part)
+            self.used += len(part)
+            chunk = chunk[len(part):]
+            if len(part) == space:
+                self.flush()
+
+    def flush(self):
+        offset = self.segment["start"] + self.segment["done"]
+        chunks = self.chunks
+        written = 0
+        while written < self.used:
+            n = os.pwritev(self.fd, chunks, offset + written)
+            written += n
+            # a short write - the rest of the chunks is written again
+            while chunks and n >= len(chunks[0]):
+                n -= len(chunks[0])
+                chunks = chunks[1:]
+            if n:
+                chunks = [chunks[0][n:]] + chunks[1:]
+        with self.lock:
+            self.segment["done"] += self.used
+        self.chunks = []
+        self.used = 0
+
+
+def download_segment(source: DownloadSource, fd: int, size: int, segment: dict, scheduler: SegmentScheduler,
+                     bar: tqdm, rate_limiter: RateLimiter, stop: threading.Event) -> bool:
+    """Returns False if the segment was left unfinished (stop or a faster source is available)"""
+    offset = segment["start"] + segment["done"]
+    with source.session.get(source.url, headers={"Range": f'bytes={offset}-{segment["end"]}'},
+                            stream=True, timeout=(5, 30)) as r:
+        if r.status_code != 206:
+            raise HTTPError(f'Range request is not supported: {r.status_code}')
+        # every source must serve exactly the same file
+        if not r.headers.get('content-range', '').endswith(f'/{size}'):
+            raise HTTPError(f'Unexpected Content-Range {r.headers.get("content-range")}')
+
+        last_time = time.monotonic()
+        loaded = 0
+        writer = SegmentWriter(fd, segment, scheduler.lock)
+        try:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if stop.is_set():
+                    return False
+                chunk = chunk[:segment["end"] + 1 - offset]
+                if rate_limiter is not None:
+                    rate_limiter.consume(len(chunk))
+                writer.write(chunk)
+                offset += len(chunk)
+                loaded += len(chunk)
+                bar.update(len(chunk))
+                if offset > segment["end"]:
+                    # the end of the segment was moved back (SegmentScheduler._split), the rest is not needed
+                    break
+
+                curtime = time.monotonic()
+                if curtime - last_time > 1:
+                    scheduler.report(source, loaded, curtime - last_time)
+                    last_time = curtime
+                    loaded = 0
+                    if offset <= segment["end"] and scheduler.is_slow(source):
+                        logger.debug(f'Moving segment {segment["start"]}-{segment["end"]} away from slow source '
+                                     f'{source.url}')
+                        return False
+        finally:
+            # the received data is kept also when the segment is interrupted
+            writer.flush()
+
+    return offset > segment["end"]
+
+
+def download_worker(scheduler: SegmentScheduler, fd: int, size: int, bar: tqdm, rate_limiter: RateLimiter,
+                    stop: threading.Event):
+    while not stop.is_set():
+        job = scheduler.next_job()
+        if job is None:
+            return
+        segment, source = job
+        try:
+            finished = download_segment(source, fd, size, segment, scheduler, bar, rate_limiter, stop)
+        except (RequestException, OSError) as segmentErr:
+            logger.debug(f'Segment {segment["start"]}-{segment["end"]} from {source.url} failed {segmentErr}')
+            scheduler.fail(segment, source)
+            time.sleep(1)
+        else:
+            scheduler.release(segment, source, finished)
+
+
+def continue_stream(stream: ProbeStream, segment: dict, scheduler: SegmentScheduler, fd: int, size: int, bar: tqdm,
+                    rate_limiter: RateLimiter, stop: threading.Event):
+    """Keeps reading the speed test stream for as long as the segments it runs into are still pending,
+    then works as a regular download worker. segment - the claimed segment the stream has reached"""
+    offset = stream.loaded
+    leftover = b''
+    try:
+        while segment is not None and not stop.is_set():
+            chunk = leftover or next(stream.chunks, b'')
+            if not chunk:
+                break
+            part = chunk[:segment["end"] + 1 - offset]
+            leftover = chunk[len(part):]
+            if rate_limiter is not None:
+                rate_limiter.consume(len(part))
+            os.pwrite(fd, part, offset)
+            offset += len(part)
+            with scheduler.lock:
+                segment["done"] += len(part)
+            bar.update(len(part))
+            if offset > segment["end"]:
+                segment = scheduler.claim(offset)
+
+    except (RequestException, OSError) as streamErr:
+        logger.debug(f'The speed test stream of {stream.rpc_address} is interrupted {streamErr}')
+
+    finally:
+        stream.close()
+        if segment is not None and segment["done"] < segment["end"] - segment["start"] + 1:
+            scheduler.requeue(segment)
+
+    download_worker(scheduler, fd, size, bar, rate_limiter, stop)
+
+
+def adopt_head_stream(head_stream: ProbeStream, fname: str, temp_fname: str) -> bool:
+    """Turns the spool file of the speed test stream into the temp file of the download"""
+    if head_stream is None or head_stream.spool is None or head_stream.fname != fname:
+        return False
+    os.replace(head_stream.detach_spool(), temp_fname)
+    logger.info(f'Continuing the speed test stream of {head_stream.rpc_address}, '
+                f'{convert_size(head_stream.loaded)} of {fname} are already downloaded')
+    return True
+
+
+def abort_response(response: requests.Response):
+    # close() waits for a read in progress, shutting the socket down interrupts a source stuck in the middle of a response
+    sock = getattr(getattr(response.raw, 'connection', None), 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class Downloader:
+    """Downloads snapshot archives into snapshot_path.
+    The built-in downloader uses connections parallel range requests, wget_path switches to wget instead.
+    max_speed_mb - download speed limit (MB/s) or None. verify - check archives while they are downloaded.
+    An archive is downloaded into <temp_prefix><name> and renamed when it is complete.
+    storage - checks the free space before a download and cleans up the snapshots superseded by it"""
+
+    def __init__(self, session: requests.Session, snapshot_path: str, connections: int = 8,
+                 max_speed_mb: int = None, wget_path: str = None, verify: bool = False, temp_prefix: str = 'tmp-',
+                 storage: Storage = None):
+        self.storage = storage
+        self.session = session
+        self.snapshot_path = snapshot_path
+        self.connections = connections
+        self.max_speed_mb = max_speed_mb
+        self.wget_path = wget_path
+        self.verify = verify
+        self.temp_prefix = temp_prefix
+
+    def download_stream(self, url: str, temp_fname: str, rate_limiter: RateLimiter, head_stream: ProbeStream = None,
+                        verifier: ArchiveVerifier = None):
+        # fallback for servers without range requests: one connection, no resume
+        fname = os.path.basename(temp_fname)[len(self.temp_prefix):]
+        if adopt_head_stream(head_stream, fname, temp_fname):
+            r, chunks, mode = head_stream.response, head_stream.chunks, 'ab'
+            if verifier is not None:
+                verify_file(verifier, temp_fname, close=False)
+        else:
+            r = self.session.get(url, stream=True, timeout=(5, 30))
+            chunks, mode = r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE), 'wb'
+
+        with r, open(temp_fname, mode) as file:
+            r.raise_for_status()
+            with tqdm(desc=fname, total=int(r.headers.get('content-length', 0)), initial=file.tell(),
+                      unit='iB', unit_scale=True, unit_divisor=1024) as bar:
+                for chunk in chunks:
+                    if rate_limiter is not None:
+                        rate_limiter.consume(len(chunk))
+                    file.write(chunk)
+                    bar.update(len(chunk))
+                    if verifier is not None:
+                        verifier.feed(chunk)
+        if verifier is not None:
+            verifier.close()
+
+    def download_parallel(self, urls: list, fname: str, temp_fname: str, head_stream: ProbeStream = None,
+                          verifier: ArchiveVerifier = None):
+        """Downloads the archive into temp_fname over several connections using http range requests.
+        urls - nodes serving the same archive, the first one is the preferred source.
+        head_stream - speed test stream of the archive, it continues as the first connection of the download.
+        Progress is stored in the temp_fname.progress file, so an interrupted download continues from where it stopped.
+        verifier - checks the archive while it is downloaded, raises ArchiveError"""
+        try:
+            progress_fname = f'{temp_fname}.progress'
+            rate_limiter = RateLimiter(self.max_speed_mb * 1024 * 1024) if self.max_speed_mb is not None else None
+
+            r = self.session.head(urls[0], allow_redirects=True, timeout=5)
+            r.raise_for_status()
+            size = int(r.headers.get('content-length', 0))
+            if size > 0 and self.storage is not None:
+                self.storage.preflight(fname, size, temp_fname)
+            if size == 0 or r.headers.get('accept-ranges', '').lower() != 'bytes':
+                logger.info(f'The server does not support range requests --> downloading over a single connection')
+                self.download_stream(urls[0], temp_fname, rate_limiter, head_stream, verifier)
+                return
+
+            segments = load_progress(progress_fname, fname, size) if os.path.exists(temp_fname) else None
+            if segments is not None:
+                logger.info(f'Resuming the download of {fname}')
+            else:
+                segments = split_into_segments(size, self.connections)
+                if adopt_head_stream(head_stream, fname, temp_fname):
+                    for segment in segments:
+                        segment["done"] = min(max(head_stream.loaded - segment["start"], 0),
+                                              segment["end"] - segment["start"] + 1)
+                    self.download_segments(urls, fname, temp_fname, size, segments, rate_limiter, head_stream,
+                                           verifier)
+                    head_stream = None
+                    return
+
+            self.download_segments(urls, fname, temp_fname, size, segments, rate_limiter, verifier=verifier)
+
+        finally:
+            if head_stream is not None:
+                head_stream.close()
+
+    def download_segments(self, urls: list, fname: str, temp_fname: str, size: int, segments: list,
+                          rate_limiter: RateLimiter, head_stream: ProbeStream = None, verifier: ArchiveVerifier = None):
+        progress_fname = f'{temp_fname}.progress'
+
+        if len(urls) > 1:
+            logger.info(f'Downloading {fname} from {len(urls)} sources at once')
+        lock = threading.Lock()
+        stop = threading.Event()
+        scheduler = SegmentScheduler(segments, [DownloadSource(url, self.session) for url in urls], lock)
+        fd = os.open(temp_fname, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            preallocate(fd, size)
+            done = sum(segment["done"] for segment in segments)
+            with tqdm(desc=fname, total=size, initial=done, unit='iB', unit_scale=True, unit_divisor=1024) as bar, \
+                    ThreadPoolExecutor(max_workers=self.connections + 1) as executor:
+                futures = []
+                if head_stream is not None:
+                    # claimed before the workers start, so nobody else takes the segment the stream has reached
+                    futures.append(executor.submit(continue_stream, head_stream, scheduler.claim(head_stream.loaded),
+                                                   scheduler, fd, size, bar, rate_limiter, stop))
+                futures += [executor.submit(download_worker, scheduler, fd, size, bar, rate_limiter, stop)
+                            for _ in range(self.connections - len(futures))]
+                # the verifier runs next to the workers, a corrupted archive stops the download right away
+                verify_future = executor.submit(verify_segments, verifier, fd, size, segments, lock, stop) \
+                    if verifier is not None else None
+                pending = set(futures) | {verify_future} - {None}
+                try:
+                    while pending - {verify_future}:
+                        finished, pending = wait(pending, timeout=PROGRESS_SAVE_INTERVAL, return_when=FIRST_EXCEPTION)
+                        save_progress(progress_fname, fname, size, segments, lock)
+                        for future in finished:
+                            future.result()
+                    if any(segment["done"] < segment["end"] - segment["start"] + 1 for segment in segments):
+                        raise IOError(f'Download of {fname} is incomplete, no working sources left')
+                    if verify_future is not None:
+                        verify_future.result()
+                except BaseException:
+                    stop.set()
+                    raise
+                finally:
+                    save_progress(progress_fname, fname, size, segments, lock)
+
+        finally:
+            os.close(fd)
+
+        os.remove(progress_fname)
+
+    def race_source(self, url: str, path: str, fname: str, rate_limiter: RateLimiter, responses: list,
+                    finish: threading.Lock, stop: threading.Event, position: int) -> bool:
+        """One source of download_race(): downloads the archive from url into path over a single connection.
+        Returns True if this source finished first, its file is deleted otherwise"""
+        won = False
+        try:
+            r = self.session.get(url, stream=True, timeout=(5, 30))
+            responses.append(r)
+            # the response of a source that lost the race before its first byte is closed too
+            with r:
+                if stop.is_set():
+                    return False
+                verifier = make_verifier(fname) if self.verify else None
+                with open(path, 'wb') as file:
+                    r.raise_for_status()
+                    size = int(r.headers.get('content-length', 0))
+                    with tqdm(desc=f'{fname} {urlparse(url).netloc}', total=size, unit='iB', unit_scale=True,
+                              unit_divisor=1024, position=position, leave=False) as bar:
+                        for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            if stop.is_set():
+                                return False
+                            if rate_limiter is not None:
+                                rate_limiter.consume(len(chunk))
+                            file.write(chunk)
+                            bar.update(len(chunk))
+                            if verifier is not None:
+                                verifier.feed(chunk)
+                    if size and file.tell() != size:
+                        raise IOError(f'{url} closed the connection after {file.tell()} of {size} bytes')
+            if verifier is not None:
+                verifier.close()
+            # two sources may finish at the same moment, only one of them wins
+            with finish:
+                won = not stop.is_set()
+                stop.set()
+            return won
+        finally:
+            if not won and os.path.exists(path):
+                os.remove(path)
+
+    def download_race(self, urls: list, fname: str, temp_fname: str):
+        """Downloads the archive from all urls at once, each over a single connection into a file of its own.
+        The first complete (and verified) copy becomes temp_fname and the other downloads are cancelled, so a node
+        that stalls in the middle of the transfer does not hold the download up. Meant for the incremental snapshots:
+        they are small and every source takes the disk space of a whole copy"""
+        r = self.session.head(urls[0], allow_redirects=True, timeout=5)
+        r.raise_for_status()
+        size = int(r.headers.get('content-length', 0))
+        if size > 0 and self.storage is not None:
+            self.storage.preflight(fname, size * len(urls), temp_fname)
+
+        logger.info(f'Racing the download of {fname} from {len(urls)} sources, the first one to finish is kept')
+        rate_limiter = RateLimiter(self.max_speed_mb * 1024 * 1024) if self.max_speed_mb is not None else None
+        responses = []
+        finish = threading.Lock()
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=len(urls))
+        futures = {executor.submit(self.race_source, url, f'{temp_fname}.race{n}', fname, rate_limiter, responses,
+                                   finish, stop, n): n for n, url in enumerate(urls)}
+        errors = []
+        winner = None
+        try:
+            for future in as_completed(futures):
+                n = futures[future]
+                try:
+                    if future.result():
+                        winner = n
+                        break
+                except (RequestException, OSError, ValueError, ArchiveError) as raceErr:
+                    logger.info(f'{urls[n]} dropped out of the race\n{raceErr}')
+                    errors.append(raceErr)
+        finally:
+            stop.set()
+            for response in list(responses):
+                abort_response(response)
+            executor.shutdown(wait=False)
+
+        if winner is None:
+            if errors and all(isinstance(raceErr, ArchiveError) for raceErr in errors):
+                raise errors[0]
+            raise IOError(f'None of the {len(urls)} sources of {fname} delivered a complete archive')
+        logger.info(f'{urlparse(urls[winner]).netloc} won the race for {fname}')
+        os.replace(f'{temp_fname}.race{winner}', temp_fname)
+        if os.path.exists(f'{temp_fname}.progress'):
+            # an interrupted parallel download of the same archive is obsolete now
+            os.remove(f'{temp_fname}.progress')
+
+    def download_with_wget(self, url: str, temp_fname: str):
+        # dirty trick with wget. Details here - https://github.com/c29r3/solana-snapshot-finder/issues/11
+        if self.max_speed_mb is not None:
+            process = subprocess.run([self.wget_path, '--progress=dot:giga', f'--limit-rate={self.max_speed_mb}M',
+                                      '--trust-server-names', url, f'-O{temp_fname}'],
+              stdout=subprocess.PIPE,
+              universal_newlines=True)
+        else:
+            process = subprocess.run([self.wget_path, '--progress=dot:giga', '--trust-server-names', url,
+                                      f'-O{temp_fname}'],
+              stdout=subprocess.PIPE,
+              universal_newlines=True)
+
+    def download(self, url: str, mirrors: list = None, head_stream: ProbeStream = None, race: bool = False) -> str:
+        """mirrors - other nodes serving the same archive, used together with url by the built-in downloader.
+        race - download the archive from url and every mirror at once and keep the first copy, see download_race().
+        head_stream - the speed test stream of this archive, its bytes become the beginning of the download.
+        Returns the path of the downloaded archive. Raises ArchiveError if the archive is corrupted
+        (the partial download is deleted then), RequestException or OSError if the download failed"""
+        fname = url[url.rfind('/'):].replace("/", "")
+        temp_fname = f'{self.snapshot_path}/{self.temp_prefix}{fname}'
+        verifier = make_verifier(fname) if self.verify else None
+
+        try:
+            if self.wget_path is not None:
+                if self.storage is not None:
+                    r = self.session.head(url, allow_redirects=True, timeout=5)
+                    if int(r.headers.get('content-length', 0)) > 0:
+                        self.storage.preflight(fname, int(r.headers['content-length']), temp_fname)
+                self.download_with_wget(url, temp_fname)
+                if verifier is not None:
+                    verify_file(verifier, temp_fname)
+            elif race and mirrors:
+                self.download_race([url] + mirrors, fname, temp_fname)
+            else:
+                # download_parallel() takes care of the stream
+                stream, head_stream = head_stream, None
+                self.download_parallel([url] + (mirrors or []), fname, temp_fname, stream, verifier)
+
+        except ArchiveError:
+            for path in (temp_fname, f'{temp_fname}.progress'):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        finally:
+            if head_stream is not None:
+                head_stream.close()
+
+        logger.info(f'Rename the downloaded file {temp_fname} --> {fname}')
+        os.rename(temp_fname, f'{self.snapshot_path}/{fname}')
+        if self.storage is not None:
+            self.storage.clean(fname)
+        return f'{self.snapshot_path}/{fname}'
@@ -0,0 +1,127 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# histogram buckets of durations (seconds) and of speeds (bytes/s)
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+SPEED_BUCKETS = (1e6, 5e6, 10e6, 25e6, 50e6, 100e6, 200e6, 500e6, 1e9)
+
+
+class Metrics:
+    """Thread-safe counters, gauges and histograms of the run and the time spent in every phase.
+    Exported as a Prometheus textfile and as a json report"""
+
+    def __init__(self, prefix: str = 'snapshot_finder'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.phases = {}
+        self.started_at = time.time()
+
+    @staticmethod
+    def _key(name: str, labels: dict):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def get(self, name: str, **labels) -> float:
+        with self.lock:
+            return self.counters.get(self._key(name, labels), 0)
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, buckets: tuple = TIME_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.setdefault(key, {"buckets": buckets, "counts": [0] * len(buckets),
+                                                         "sum": 0.0, "count": 0})
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - start_time, **labels)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        # a phase that runs several times (every attempt) is summed up
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0) + time.monotonic() - start_time
+
+    @staticmethod
+    def _labels(labels: tuple, extra: str = '') -> str:
+        pairs = [f'{name}="{value}"' for name, value in labels] + ([extra] if extra else [])
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for kind, suffix, values in (('counter', '_total', self.counters), ('gauge', '', self.gauges)):
+                for name in sorted({name for name, _ in values}):
+                    lines.append(f'# TYPE {self.prefix}_{name}{suffix} {kind}')
+                    lines += [f'{self.prefix}_{name}{suffix}{self._labels(labels)} {value}'
+                              for (metric, labels), value in values.items() if metric == name]
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# TYPE {self.prefix}_{name} histogram')
+                for (metric, labels), histogram in self.histograms.items():
+                    if metric != name:
+                        continue
+                    buckets = list(zip(histogram["buckets"], histogram["counts"])) + [('+Inf', histogram["count"])]
+                    for bound, count in buckets:
+                        le = f'le="{bound}"'
+                        lines.append(f'{self.prefix}_{name}_bucket{self._labels(labels, le)} {count}')
+                    lines.append(f'{self.prefix}_{name}_sum{self._labels(labels)} {histogram["sum"]}')
+                    lines.append(f'{self.prefix}_{name}_count{self._labels(labels)} {histogram["count"]}')
+            lines.append(f'# TYPE {self.prefix}_phase_seconds gauge')
+            lines += [f'{self.prefix}_phase_seconds{{phase="{name}"}} {seconds}'
+                      for name, seconds in self.phases.items()]
+        return '\n'.join(lines) + '\n'
+
+    def report(self) -> dict:
+        def by_labels(values: dict) -> dict:
+            grouped = {}
+            for (name, labels), value in values.items():
+                grouped.setdefault(name, {})[','.join(f'{k}={v}' for k, v in labels)] = value
+            return grouped
+
+        with self.lock:
+            histograms = {key: {"count": h["count"], "sum": h["sum"],
+                                "mean": h["sum"] / h["count"] if h["count"] else 0,
+                                "buckets": dict(zip(map(str, h["buckets"]), h["counts"]))}
+                          for key, h in self.histograms.items()}
+            return {"started_at": self.started_at, "duration": time.time() - self.started_at,
+                    "phases": dict(self.phases), "counters": by_labels(self.counters), "gauges": by_labels(self.gauges),
+                    "histograms": by_labels(histograms)}
+
+    def save(self, textfile: str, report_path: str):
+        for path, content in ((textfile, self.prometheus()), (report_path, json.dumps(self.report(), indent=2))):
+            try:
+                # node_exporter must never see a half-written file
+                with open(f'{path}.new', "w") as metrics_f:
+                    metrics_f.write(content)
+                os.replace(f'{path}.new', path)
+            except OSError as metricsErr:
+                logger.error(f'Can\'t save the metrics to {path}\n{metricsErr}')
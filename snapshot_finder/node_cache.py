@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# a node that failed this many probes in a row is skipped until its cache entry expires
+NODE_CACHE_MAX_FAILURES = 3
+
+
+class NodeCache:
+    """Reputation of rpc nodes kept between runs in node_cache.json next to snapshot.json:
+    latency, measured download speed, the last seen snapshot slots and the number of failed probes in a row.
+    Entries that have not been updated for ttl seconds are forgotten, the speed and the failures expire ttl seconds
+    after they were measured even if the node keeps answering the probes. ttl=0 disables the cache.
+    Nodes measured slower than min_speed (bytes/s) are considered slow"""
+
+    def __init__(self, path: str, ttl: int, min_speed: float = 0):
+        self.path = path
+        self.ttl = ttl
+        self.min_speed = min_speed
+        self.nodes = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.ttl <= 0:
+            return
+        try:
+            with open(self.path) as cache_f:
+                nodes = json.load(cache_f)
+        except (OSError, ValueError):
+            return
+        self.nodes = {address: self._expire(node) for address, node in nodes.items()
+                      if self._fresh(node, "updated_at")}
+        logger.info(f'Loaded {len(self.nodes)} rpc nodes from the node cache {self.path}')
+
+    def save(self):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            nodes = json.dumps(self.nodes)
+        with open(f'{self.path}.new', "w") as cache_f:
+            cache_f.write(nodes)
+        os.replace(f'{self.path}.new', self.path)
+
+    def _fresh(self, node: dict, key: str) -> bool:
+        # within one run (ttl=0) nothing expires
+        return self.ttl <= 0 or node.get(key, 0) > time.time() - self.ttl
+
+    def _expire(self, node: dict) -> dict:
+        # drops the measurements older than ttl, the rest of the entry is kept
+        if not self._fresh(node, "speed_at"):
+            node.pop("speed", None)
+            node.pop("speed_at", None)
+        if not self._fresh(node, "failed_at"):
+            node["failures"] = 0
+        return node
+
+    def _node(self, rpc_address: str) -> dict:
+        node = self.nodes.setdefault(rpc_address, {"failures": 0})
+        node["updated_at"] = time.time()
+        return node
+
+    def record_probe(self, rpc_address: str, latency: float = None, full_slot: int = None, inc_slot: int = None):
+        """latency=None - the node did not respond with a snapshot location"""
+        with self.lock:
+            node = self._node(rpc_address)
+            if latency is None:
+                node["failures"] = self._expire(node)["failures"] + 1
+                node["failed_at"] = time.time()
+                return
+            node.update({"failures": 0, "latency": latency, "last_seen_at": time.time()})
+            if full_slot is not None:
+                node["full_slot"] = full_slot
+            if inc_slot is not None:
+                node["inc_slot"] = inc_slot
+
+    def record_corrupt(self, rpc_address: str):
+        # the node served a corrupted archive, skip it until the entry expires
+        with self.lock:
+            self._node(rpc_address).update({"failures": NODE_CACHE_MAX_FAILURES, "failed_at": time.time()})
+
+    def record_speed(self, rpc_address: str, speed: float):
+        with self.lock:
+            node = self._node(rpc_address)
+            node.update({"speed": speed, "speed_at": time.time()})
+
+    def speed(self, rpc_address: str):
+        """Download speed (bytes/s) measured during the cache ttl or None"""
+        node = self.nodes.get(rpc_address, {})
+        return node.get("speed") if self._fresh(node, "speed_at") else None
+
+    def is_bad(self, rpc_address: str) -> bool:
+        node = self.nodes.get(rpc_address, {})
+        return node.get("failures", 0) >= NODE_CACHE_MAX_FAILURES and self._fresh(node, "failed_at")
+
+    def is_slow(self, rpc_address: str) -> bool:
+        speed = self.speed(rpc_address)
+        return speed is not None and speed < self.min_speed
+
+    def priority(self, rpc_address: str):
+        # historically fast nodes first, then the ones that responded before, unknown nodes, slow nodes last
+        node = self.nodes.get(rpc_address, {})
+        if self.is_slow(rpc_address):
+            return 3, 0
+        if self.speed(rpc_address) is not None:
+            return 0, -self.speed(rpc_address)
+        if "latency" in node:
+            return 1, node["latency"]
+        return 2, 0
@@ -0,0 +1,136 @@
+import glob
+import logging
+import os
+import threading
+import time
+
+from .download import Downloader
+from .records import ScanResult, snapshot_slot
+from .storage import DiskSpaceError
+
+logger = logging.getLogger(__name__)
+
+# unfinished prefetches are kept apart from the downloads of a restart running at the same time
+PREFETCH_TEMP_PREFIX = 'tmp-prefetch-'
+# a prefetch of the same archive is not started again sooner than this after a failure (seconds)
+PREFETCH_RETRY_INTERVAL = 300
+
+
+def local_full_snapshots(snapshot_path: str) -> list:
+    """(slot, path) of the full snapshots in snapshot_path, the newest first"""
+    snapshots = []
+    for path in glob.glob(f'{snapshot_path}/snapshot-*tar*'):
+        slot = snapshot_slot(os.path.basename(path))
+        if slot is not None:
+            snapshots.append((slot, path))
+    return sorted(snapshots, reverse=True)
+
+
+def rotate_full_snapshots(snapshot_path: str, keep: int, disk_budget: float = None) -> list:
+    """Deletes the oldest full snapshots, so that no more than keep of them are left and together they take
+    no more than disk_budget bytes. The newest one is always kept. The incremental snapshots based on a deleted
+    full snapshot and unfinished prefetches of older slots are deleted too. Returns the deleted paths"""
+    snapshots = local_full_snapshots(snapshot_path)
+    deleted = []
+    kept_size = 0
+    rotating = False
+    for n, (slot, path) in enumerate(snapshots):
+        size = os.path.getsize(path)
+        rotating = rotating or (n > 0 and (n >= keep or (disk_budget is not None and kept_size + size > disk_budget)))
+        if not rotating:
+            kept_size += size
+            continue
+        deleted.append(path)
+        deleted += glob.glob(f'{snapshot_path}/incremental-snapshot-{slot}-*')
+
+    if snapshots:
+        for path in glob.glob(f'{snapshot_path}/{PREFETCH_TEMP_PREFIX}snapshot-*'):
+            slot = snapshot_slot(os.path.basename(path)[len(PREFETCH_TEMP_PREFIX):])
+            if slot is not None and slot <= snapshots[0][0]:
+                deleted.append(path)
+
+    for path in deleted:
+        logger.info(f'Rotating out {path}')
+        os.remove(path)
+    return deleted
+
+
+class Prefetcher:
+    """Downloads the newest full snapshot of the cluster in the background, so that a restart only has to download
+    the incremental snapshot. The download speed is capped at config.prefetch_max_speed, old full snapshots are
+    rotated out by rotate_full_snapshots() once the new one is complete. Used by SnapshotDaemon with --prefetch.
+    scanner - SnapshotScanner whose connections, node cache and metrics are used"""
+
+    def __init__(self, scanner):
+        config = scanner.config
+        self.scanner = scanner
+        self.config = config
+        self.downloader = Downloader(scanner.session, config.snapshot_path, config.download_connections,
+                                     config.prefetch_max_speed, scanner.wget_path, config.verify, PREFETCH_TEMP_PREFIX,
+                                     scanner.storage)
+        self.thread = None
+        self.location = None
+        # location -> time of the last failed prefetch
+        self.failed_at = {}
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    @staticmethod
+    def target(candidates: ScanResult):
+        """The newest full snapshot served by the candidates and the urls of the nodes serving it, the best first"""
+        full = {}
+        for rpc_node in candidates.rpc_nodes:
+            for path in rpc_node.files_to_download:
+                if path.startswith('/snapshot-'):
+                    full.setdefault(path, []).append(f'http://{rpc_node.snapshot_address}{path}')
+        if not full:
+            return None, []
+        location = max(full, key=lambda path: snapshot_slot(path) or 0)
+        return location, full[location]
+
+    def maybe_start(self, candidates: ScanResult) -> bool:
+        """Starts the prefetch if the candidates serve a full snapshot newer than the local ones.
+        candidates must list the full snapshots of the nodes, see SnapshotDaemon.candidates()"""
+        if self.running:
+            return False
+        location, urls = self.target(candidates)
+        if location is None:
+            return False
+        slot = snapshot_slot(location)
+        if slot is None:
+            # a path without a slot can't be compared with the local snapshots
+            return False
+        local = local_full_snapshots(self.config.snapshot_path)
+        if local and local[0][0] >= slot:
+            return False
+        if time.time() - self.failed_at.get(location, 0) < PREFETCH_RETRY_INTERVAL:
+            return False
+
+        self.location = location
+        self.thread = threading.Thread(target=self.prefetch, args=(location, urls), daemon=True)
+        self.thread.start()
+        return True
+
+    def prefetch(self, location: str, urls: list) -> bool:
+        speed_limit = 'full speed' if self.config.prefetch_max_speed is None \
+            else f'{self.config.prefetch_max_speed} MB/s'
+        logger.info(f'Prefetching the full snapshot {location} from {urls[0]} at {speed_limit}')
+        with self.scanner.metrics.phase('prefetch'):
+            try:
+                downloaded = self.scanner.download(urls[0], mirrors=urls[1:self.config.swarm_sources],
+                                                   downloader=self.downloader)
+            except DiskSpaceError as spaceErr:
+                logger.error(f'Not enough disk space for the prefetch of {location}\n{spaceErr}')
+                downloaded = False
+        if not downloaded:
+            self.failed_at[location] = time.time()
+            return False
+        rotate_full_snapshots(self.config.snapshot_path, self.config.prefetch_keep,
+                              self.config.prefetch_disk_budget * 1e9 if self.config.prefetch_disk_budget else None)
+        return True
+
+    def status(self) -> dict:
+        return {"running": self.running, "location": self.location,
+                "local_full_slots": [slot for slot, path in local_full_snapshots(self.config.snapshot_path)]}
@@ -0,0 +1,81 @@
+import json
+import os
+
+
+def snapshot_slot(location: str):
+    """Slot of the snapshot archive: /snapshot-<slot>-<hash>.tar.zst or /incremental-snapshot-<base>-<slot>-<hash>..."""
+    try:
+        return int(location.split("-")[3 if 'incremental' in location else 1])
+    except (IndexError, ValueError):
+        return None
+
+
+class NodeRecord:
+    """An rpc node serving suitable snapshots. files_to_download - archive paths, the incremental snapshot first.
+    score - expected time (seconds) until a validator started from these snapshots is ready, lower is better"""
+    __slots__ = ('snapshot_address', 'slots_diff', 'latency', 'files_to_download', 'score')
+
+    def __init__(self, snapshot_address: str, slots_diff: int, latency: float, files_to_download: list,
+                 score: float = None):
+        self.snapshot_address = snapshot_address
+        self.slots_diff = slots_diff
+        self.latency = latency
+        self.files_to_download = files_to_download
+        self.score = score
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, node: dict) -> 'NodeRecord':
+        return cls(node["snapshot_address"], node["slots_diff"], node["latency"], node["files_to_download"],
+                   node.get("score"))
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class ScanResult:
+    """Snapshots found on the rpc nodes of the cluster, stored as snapshot.json.
+    cluster_nodes - rpc address -> version of every node from getClusterNodes"""
+    __slots__ = ('last_update_at', 'last_update_slot', 'total_rpc_nodes', 'rpc_nodes', 'cluster_nodes')
+
+    def __init__(self, last_update_at: float = 0.0, last_update_slot: int = 0, total_rpc_nodes: int = 0,
+                 rpc_nodes: list = None, cluster_nodes: dict = None):
+        self.last_update_at = last_update_at
+        self.last_update_slot = last_update_slot
+        self.total_rpc_nodes = total_rpc_nodes
+        self.rpc_nodes = rpc_nodes if rpc_nodes is not None else []
+        self.cluster_nodes = cluster_nodes
+
+    def to_dict(self) -> dict:
+        result = {
+            "last_update_at": self.last_update_at,
+            "last_update_slot": self.last_update_slot,
+            "total_rpc_nodes": self.total_rpc_nodes,
+            "rpc_nodes_with_actual_snapshot": len(self.rpc_nodes),
+            "rpc_nodes": [node.to_dict() for node in self.rpc_nodes],
+        }
+        if self.cluster_nodes is not None:
+            result["cluster_nodes"] = self.cluster_nodes
+        return result
+
+    @classmethod
+    def from_dict(cls, result: dict) -> 'ScanResult':
+        return cls(result.get("last_update_at", 0.0), result.get("last_update_slot", 0),
+                   result.get("total_rpc_nodes", 0),
+                   [NodeRecord.from_dict(node) for node in result.get("rpc_nodes", [])], result.get("cluster_nodes"))
+
+    def save(self, path: str):
+        with open(f'{path}.new', "w") as result_f:
+            json.dump(self.to_dict(), result_f, indent=2)
+        os.replace(f'{path}.new', path)
+
+    @classmethod
+    def load(cls, path: str):
+        """Returns None if there is no valid file"""
+        try:
+            with open(path) as result_f:
+                return cls.from_dict(json.load(result_f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
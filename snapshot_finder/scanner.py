@@ -0,0 +1,799 @@
+import asyncio
+import glob
+import http.client
+import json
+import logging
+import os
+import shutil
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests import ReadTimeout, ConnectTimeout, HTTPError, Timeout, ConnectionError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from tqdm import tqdm
+
+from .config import Config
+from .daemon import daemon_request
+from .discovery import AdaptiveLimiter, AsyncConnectionPool, probe_snapshot_locations
+from .download import Downloader
+from .metrics import Metrics, SPEED_BUCKETS
+from .node_cache import NodeCache
+from .records import NodeRecord, ScanResult, snapshot_slot
+from .scoring import EARLY_EXIT_MAX_SLOTS_DIFF, ready_seconds
+from .speedtest import ProbeStream, convert_size, iter_speed_buckets, speed_score, speed_tournament
+from .storage import DiskSpaceError, Storage
+from .topology import Topology
+from .verify import ArchiveError, missing_decoders
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {"Content-Type": "application/json"}
+# reasons for which rpc nodes are skipped, counted by the "discarded" metric
+DISCARD_REASONS = ('archive_type', 'latency', 'slot', 'version', 'timeout', 'unknw_err')
+# no more than this number of rpc nodes are speed tested in one scan
+NUM_OF_RPC_TO_CHECK = 15
+# nodes that timed out in the first pass of the discovery are probed again with a timeout this many times longer
+PROBE_TIMEOUT_ESCALATION = 3
+# for an incremental snapshot race this many times more nodes are probed than needed, not all of them serve the newest one
+RACE_PROBE_FACTOR = 2
+
+
+def make_http_session(pool_size: int, connections: int) -> requests.Session:
+    # keep-alive connections for the rpc endpoint, speed tests and downloads. Pools of the least recently used hosts
+    # are dropped once there are more than pool_size of them
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=max(4, connections))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class SnapshotScanner:
+    """Finds rpc nodes of the cluster serving fresh snapshots and downloads the snapshots into config.snapshot_path.
+
+        with SnapshotScanner(Config(snapshot_path='/mnt/snapshots')) as scanner:
+            result = scanner.scan()    # ScanResult, nothing is downloaded
+            exit_code = scanner.run()  # scan and download with retries, like snapshot-finder.py
+
+    One scanner keeps its keep-alive connections, event loop and node cache between calls.
+    It is not thread-safe, use one scanner per thread.
+    cluster - the scanner of another target of the same cluster whose event loop, connections, node cache,
+    network topology and metrics are shared, see BatchRunner. It is closed by its owner"""
+
+    def __init__(self, config: Config, cluster: 'SnapshotScanner' = None):
+        self.config = config
+        self.cluster = cluster
+        self.wget_path = shutil.which("wget") if config.wget else None
+        if config.wget and self.wget_path is None:
+            raise RuntimeError('The wget utility was not found in the system, it is required')
+        if config.verify and missing_decoders():
+            # the clusters publish .tar.zst archives, they would be downloaded unverified
+            raise RuntimeError(f'--verify needs the missing packages {", ".join(missing_decoders())}: '
+                               f'pip3 install -r requirements.txt')
+
+        if cluster is not None:
+            self.event_loop, self.connection_pool, self.probe_limiter = \
+                cluster.event_loop, cluster.connection_pool, cluster.probe_limiter
+            self.session, self.node_cache, self.topology, self.metrics = \
+                cluster.session, cluster.node_cache, cluster.topology, cluster.metrics
+        else:
+            # one event loop and one set of keep-alive connections for the life of the scanner (all attempts)
+            self.event_loop = asyncio.new_event_loop()
+            self.connection_pool = AsyncConnectionPool(max_size=config.pool_size,
+                                                       idle_timeout=config.pool_idle_timeout)
+            # no more than threads_count probes in flight, fewer if the network is congested
+            self.probe_limiter = AdaptiveLimiter(config.threads_count)
+            self.session = make_http_session(config.pool_size, config.download_connections)
+            self.node_cache = NodeCache(f'{config.snapshot_path}/node_cache.json', config.node_cache_ttl,
+                                        config.min_download_speed_bytes)
+            self.node_cache.load()
+            self.topology = Topology(config.subnet_prefix, config.asn_db)
+            self.metrics = Metrics()
+        self.storage = Storage(config.snapshot_path, config.cleanup, config.archive_path)
+        self.downloader = Downloader(self.session, config.snapshot_path, config.download_connections,
+                                     config.max_download_speed, self.wget_path, config.verify, storage=self.storage)
+
+        # rpc address -> version of every node from the last getClusterNodes, compared with the previous run by warm_start
+        self.cluster_versions = {}
+        # rpc addresses taken from the gossip addresses of the nodes with a private rpc (with_private_rpc)
+        self.private_rpc_nodes = set()
+        self.current_slot = 0
+        self.full_local_snap_slot = 0
+        self.max_snapshot_age = 0 if config.slot != 0 else config.max_snapshot_age
+        self.reset()
+
+    def reset(self):
+        """Forgets the state of the previous run(), the node cache decides which nodes are skipped"""
+        # skip servers that do not fit the filters so as not to check them again.
+        # Nodes measured as too slow during the cache ttl are not speed tested again
+        self.unsuitable_servers = {address for address in self.node_cache.nodes if self.node_cache.is_slow(address)}
+        # network groups (see Topology) whose node was too slow in the speed test, their other nodes are tested last
+        self.slow_groups = set()
+        # rpc address -> (incremental probe, full probe) of every node probed by the last discovery
+        self.probes = {}
+        self.with_private_rpc = self.config.with_private_rpc
+        self.result = ScanResult()
+
+    @property
+    def result_path(self) -> str:
+        return f'{self.config.snapshot_path}/snapshot.json'
+
+    def close(self):
+        if self.cluster is not None:
+            return
+        self.connection_pool.close()
+        self.session.close()
+        self.event_loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _rpc_request(self, method: str):
+        """Result of the json rpc method of config.rpc_address or None"""
+        data = json.dumps({"jsonrpc": "2.0", "id": 1, "method": method})
+        try:
+            with self.metrics.timer('rpc_request_seconds', method=method):
+                r = self.session.post(self.config.rpc_address, headers=DEFAULT_HEADERS, data=data, timeout=(25, 25))
+            if 'result' in r.text:
+                return r.json()["result"]
+            logger.debug(f'{method} failed {r.status_code} {r.text}')
+
+        except (ReadTimeout, ConnectTimeout, HTTPError, Timeout, ConnectionError) as reqErr:
+            self.metrics.inc('discarded', reason='timeout')
+            logger.debug(f'{method} failed {reqErr}')
+
+        except Exception as unknwErr:
+            self.metrics.inc('discarded', reason='unknw_err')
+            logger.debug(f'{method} failed {unknwErr}')
+        return None
+
+    def update_current_slot(self) -> bool:
+        """Takes the current slot from config.slot or from the rpc. Returns False if it is unknown"""
+        if self.config.slot != 0:
+            self.current_slot = self.config.slot
+            return True
+        logger.debug("get_current_slot()")
+        with self.metrics.phase('current_slot'):
+            current_slot = self._rpc_request('getSlot')
+        if current_slot is None:
+            logger.error(f'Can\'t get current slot')
+            return False
+        self.current_slot = current_slot
+        return True
+
+    def get_rpc_nodes(self):
+        """Rpc addresses of the cluster that pass the version filters and the blacklists, one node of every
+        network group first, historically fast nodes first. Returns None if the rpc does not respond"""
+        logger.debug("get_rpc_nodes()")
+        with self.metrics.phase('cluster_nodes'):
+            cluster_nodes = self._rpc_request('getClusterNodes')
+        if cluster_nodes is None:
+            logger.error(f'Can\'t get RPC ip addresses from {self.config.rpc_address}')
+            return None
+
+        rpc_ips = []
+        for node in cluster_nodes:
+            if not self.version_matches(node["version"]):
+                self.metrics.inc('discarded', reason='version')
+                continue
+            if node["rpc"] is not None:
+                rpc_ips.append(node["rpc"])
+                self.cluster_versions[node["rpc"]] = node["version"]
+            elif self.with_private_rpc is True:
+                gossip_ip = node["gossip"].split(":")[0]
+                rpc_ips.append(f'{gossip_ip}:8899')
+                self.cluster_versions[f'{gossip_ip}:8899'] = node["version"]
+                self.private_rpc_nodes.add(f'{gossip_ip}:8899')
+
+        rpc_ips = list(set(rpc_ips))
+        logger.debug(f'RPC_IPS LEN before blacklisting {len(rpc_ips)}')
+        # removing blacklisted ip addresses
+        rpc_ips = list(set(rpc_ips) - set(self.config.ip_blacklist))
+        logger.debug(f'RPC_IPS LEN after blacklisting {len(rpc_ips)}')
+
+        # skip nodes that kept failing recently and probe historically fast nodes first
+        known_bad = [rpc_ip for rpc_ip in rpc_ips if self.node_cache.is_bad(rpc_ip)]
+        if known_bad:
+            logger.info(f'Skipping {len(known_bad)} rpc nodes that failed recently (node cache)')
+            rpc_ips = list(set(rpc_ips) - set(known_bad))
+        rpc_ips.sort(key=self.node_cache.priority)
+        rpc_ips = self.topology.interleave(rpc_ips)
+        network_groups = len({self.topology.group(rpc_ip) for rpc_ip in rpc_ips})
+        self.metrics.set('network_groups', network_groups)
+        logger.debug(f'{len(rpc_ips)} rpc nodes in {network_groups} network groups')
+        return rpc_ips
+
+    def version_matches(self, version) -> bool:
+        # nodes that do not report their version are not filtered out
+        return not ((self.config.wildcard_version is not None and version and self.config.wildcard_version not in version)
+                    or (self.config.version is not None and version and version != self.config.version))
+
+    def find_local_snapshot(self, verbose: bool = True):
+        # Search for full local snapshots.
+        # If such a snapshot is found and it is not too old, then the script will try to find and download an incremental snapshot
+        snapshot_path = self.config.snapshot_path
+        full_local_snapshots = glob.glob(f'{snapshot_path}/snapshot-*tar*')
+        # the snapshot found by a previous call may have been deleted or rotated out since
+        self.full_local_snap_slot = 0
+        if len(full_local_snapshots) > 0:
+            full_local_snapshots.sort(reverse=True)
+            self.full_local_snap_slot = full_local_snapshots[0].replace(snapshot_path, "").split("-")[1]
+            if verbose:
+                logger.info(f'Found full local snapshot {full_local_snapshots[0]} | {self.full_local_snap_slot=}')
+
+        elif verbose:
+            logger.info(f'Can\'t find any full local snapshots in this path {snapshot_path} --> the search will be carried out on full snapshots')
+
+    def remove_stale_probes(self):
+        # spool files of speed tests interrupted in a previous run
+        for stale_probe in glob.glob(f'{self.config.snapshot_path}/tmp-*.probe'):
+            os.remove(stale_probe)
+
+    def record_probe(self, rpc_address: str, inc_probe, full_probe):
+        """Remembers the result of the probe of a node in the node cache"""
+        if inc_probe is None and full_probe is None:
+            self.node_cache.record_probe(rpc_address)
+        else:
+            self.node_cache.record_probe(rpc_address, latency=min(p[1] for p in (inc_probe, full_probe) if p is not None),
+                                         full_slot=snapshot_slot(full_probe[0]) if full_probe is not None else None,
+                                         inc_slot=snapshot_slot(inc_probe[0]) if inc_probe is not None else None)
+
+    def make_record(self, rpc_address: str, inc_probe, full_probe, full_local_snap_slot=None):
+        """Checks the (location, latency) probes of a node against the current slot and the filters and scores it.
+        full_local_snap_slot - slot of the full snapshot on the local disk, self.full_local_snap_slot by default.
+        Returns (NodeRecord, None) for a suitable node, otherwise (None, discard reason or None)"""
+        if full_local_snap_slot is None:
+            full_local_snap_slot = self.full_local_snap_slot
+        rpc_node, reason = self._check_probes(rpc_address, inc_probe, full_probe, full_local_snap_slot)
+        if rpc_node is not None:
+            # nodes that were never measured are expected to be just fast enough
+            speed = self.node_cache.speed(rpc_address) or self.config.min_download_speed_bytes
+            rpc_node.score = ready_seconds(rpc_node, speed, full_local_snap_slot)
+        return rpc_node, reason
+
+    def _check_probes(self, rpc_address: str, inc_probe, full_probe, full_local_snap_slot):
+        try:
+            if inc_probe is not None:
+                snap_location_, latency = inc_probe
+                if latency > self.config.max_latency:
+                    return None, 'latency'
+
+                if snap_location_.endswith('tar') is True:
+                    return None, 'archive_type'
+                incremental_snap_slot = int(snap_location_.split("-")[2])
+                snap_slot_ = int(snap_location_.split("-")[3])
+                slots_diff = self.current_slot - snap_slot_
+
+                if slots_diff < -100:
+                    logger.error(f'Something wrong with this snapshot\\rpc_node - {slots_diff=}. This node will be skipped {rpc_address=}')
+                    return None, 'slot'
+
+                if slots_diff > self.max_snapshot_age:
+                    return None, 'slot'
+
+                if str(full_local_snap_slot) == str(incremental_snap_slot):
+                    return NodeRecord(rpc_address, slots_diff, latency, [snap_location_]), None
+
+                if full_probe is not None:
+                    return NodeRecord(rpc_address, slots_diff, latency, [snap_location_, full_probe[0]]), None
+
+            if full_probe is not None:
+                snap_location_, latency = full_probe
+                # filtering uncompressed archives
+                if snap_location_.endswith('tar') is True:
+                    return None, 'archive_type'
+                full_snap_slot_ = int(snap_location_.split("-")[1])
+                slots_diff_full = self.current_slot - full_snap_slot_
+                if slots_diff_full <= self.max_snapshot_age and latency <= self.config.max_latency:
+                    return NodeRecord(rpc_address, slots_diff_full, latency, [snap_location_]), None
+            return None, None
+
+        except Exception as getSnapErr_:
+            return None, None
+
+    def enough_candidates(self) -> bool:
+        """Whether the discovery can stop early: config.early_exit of the found nodes have a snapshot at most
+        EARLY_EXIT_MAX_SLOTS_DIFF slots old and a download speed of at least min_download_speed measured during
+        the node cache ttl. The score is not used, it is dominated by the download time of the archives.
+        Without measured nodes (the first run) all nodes are probed"""
+        early_exit = self.config.early_exit
+        rpc_nodes = self.result.rpc_nodes
+        if early_exit <= 0 or len(rpc_nodes) < early_exit:
+            return False
+        good = [node for node in rpc_nodes if node.slots_diff <= EARLY_EXIT_MAX_SLOTS_DIFF
+                and (self.node_cache.speed(node.snapshot_address) or 0) >= self.config.min_download_speed_bytes
+                and node.snapshot_address not in self.unsuitable_servers and not self.is_blacklisted(node)]
+        return len(good) >= early_exit
+
+    async def _probe_node(self, rpc_address: str, pbar: tqdm, enough: asyncio.Event):
+        # both locations are requested at the same time over one keep-alive connection
+        paths = ['/incremental-snapshot.tar.bz2', '/snapshot.tar.bz2']
+        async with self.probe_limiter:
+            started_at = time.monotonic()
+            probes = await probe_snapshot_locations(self.connection_pool, self.metrics, rpc_address, paths,
+                                                    self.config.probe_timeout, self.probe_limiter, final=False)
+        if probes is None:
+            # a node that timed out while the probes were congested or that responded in a previous run is probed
+            # again with a longer timeout, the others do not respond at all most probably
+            if self.probe_limiter.congested_since(started_at) \
+                    or "latency" in self.node_cache.nodes.get(rpc_address, {}):
+                # the retries take their place among the probes in flight, so they can't add to the congestion
+                self.metrics.inc('probe_retries')
+                async with self.probe_limiter:
+                    probes = await probe_snapshot_locations(self.connection_pool, self.metrics, rpc_address, paths,
+                                                            self.config.probe_timeout * PROBE_TIMEOUT_ESCALATION,
+                                                            self.probe_limiter)
+            else:
+                self.metrics.inc('discarded', len(paths), reason='timeout')
+                probes = [None] * len(paths)
+        inc_probe, full_probe = probes
+        pbar.update(1)
+        self.probes[rpc_address] = (inc_probe, full_probe)
+        self.record_probe(rpc_address, inc_probe, full_probe)
+
+        rpc_node, reason = self.make_record(rpc_address, inc_probe, full_probe)
+        if reason is not None:
+            self.metrics.inc('discarded', reason=reason)
+        if rpc_node is not None:
+            self.result.rpc_nodes.append(rpc_node)
+            if self.enough_candidates():
+                enough.set()
+
+    async def _probe_until_enough(self, probes, enough: asyncio.Event) -> bool:
+        """Waits for the probes unless enough good candidates are found first, then the remaining probes are
+        cancelled. Returns True on the early exit"""
+        probes = asyncio.gather(*probes)
+        early_exit = asyncio.ensure_future(enough.wait())
+        await asyncio.wait([probes, early_exit], return_when=asyncio.FIRST_COMPLETED)
+        early_exit.cancel()
+        if probes.done():
+            return False
+
+        probes.cancel()
+        try:
+            await probes
+        except asyncio.CancelledError:
+            pass
+        return True
+
+    async def _discover(self, rpc_nodes: list, pbar: tqdm):
+        # the number of probes in flight adapts to the network (see AdaptiveLimiter), historically fast nodes first
+        # (see get_rpc_nodes()). The remaining probes are cancelled once enough good candidates are found
+        enough = asyncio.Event()
+        early_exit = await self._probe_until_enough(
+            [self._probe_node(rpc_address, pbar, enough) for rpc_address in rpc_nodes], enough)
+        self.metrics.set('probe_concurrency_limit', self.probe_limiter.limit)
+        logger.debug(f'Probes in flight: limit {self.probe_limiter.limit} of {self.probe_limiter.max_limit}, '
+                     f'halved {len(self.probe_limiter.congestion_times)} times, '
+                     f'{self.metrics.get("probe_retries"):.0f} rpc nodes that timed out were probed again')
+        if early_exit:
+            skipped = len(rpc_nodes) - pbar.n
+            self.metrics.inc('early_exits')
+            self.metrics.inc('probes_skipped', skipped)
+            logger.info(f'Early exit: {self.config.early_exit} fast rpc nodes with a fresh snapshot are found '
+                        f'--> {skipped} rpc nodes are not probed')
+
+    def scan_plan(self, rpc_nodes: list) -> list:
+        """Groups of rpc nodes that are scanned one after another until a snapshot is downloaded.
+        With warm_start the nodes listed in the previous snapshot.json and the new or changed gossip entries go first,
+        the remaining nodes are swept only if the warm set does not give a suitable node"""
+        if not self.config.warm_start:
+            return [rpc_nodes]
+        previous = ScanResult.load(self.result_path)
+        if previous is None:
+            return [rpc_nodes]
+
+        known = {node.snapshot_address for node in previous.rpc_nodes} - self.unsuitable_servers
+        previous_cluster = previous.cluster_nodes
+        warm = [rpc_address for rpc_address in rpc_nodes if rpc_address in known or (
+            previous_cluster is not None and (rpc_address not in previous_cluster
+                                              or previous_cluster[rpc_address] != self.cluster_versions.get(rpc_address)))]
+        if not warm:
+            return [rpc_nodes]
+
+        warm_set = set(warm)
+        rest = [rpc_address for rpc_address in rpc_nodes if rpc_address not in warm_set]
+        logger.info(f'Warm start: {len(warm)} rpc nodes from snapshot.json and new gossip entries are checked first, '
+                    f'{len(rest)} are left for the full sweep')
+        return [warm, rest] if rest else [warm]
+
+    def probe_nodes(self, rpc_nodes: list):
+        """Probes rpc_nodes, the suitable ones are added to self.result and the probes are kept in self.probes"""
+        with tqdm(total=len(rpc_nodes)) as pbar:
+            print(f'Searching information about snapshots on all found RPCs')
+            with self.metrics.phase('discovery'):
+                self.event_loop.run_until_complete(self._discover(rpc_nodes, pbar))
+        self.connection_pool.evict_idle()
+        self.node_cache.save()
+
+    def scan_nodes(self, rpc_nodes: list, total_rpc_nodes: int):
+        """Probes rpc_nodes and adds the suitable ones to self.result, which is saved to snapshot.json"""
+        self.probe_nodes(rpc_nodes)
+        logger.info(f'Found suitable RPCs: {len(self.result.rpc_nodes)}')
+        discarded = ' | '.join(f'DISCARDED_BY_{reason.upper()}={self.metrics.get("discarded", reason=reason):.0f}'
+                               for reason in DISCARD_REASONS)
+        logger.info(f'The following information shows for what reason and how many RPCs were skipped.'
+        f'Timeout most probably mean, that node RPC port does not respond (port is closed)\n{discarded}')
+        self.save_result(total_rpc_nodes)
+
+    def adopt_discovery(self, cluster: 'SnapshotScanner'):
+        """Builds self.result from the discovery of the scanner of the cluster instead of probing the nodes again:
+        the nodes it probed are checked against the filters of this scanner. See BatchRunner"""
+        self.current_slot = self.config.slot or cluster.current_slot
+        self.cluster_versions = cluster.cluster_versions
+        self.result = ScanResult()
+        for rpc_address, (inc_probe, full_probe) in cluster.probes.items():
+            if not self.version_matches(cluster.cluster_versions.get(rpc_address)) \
+                    or rpc_address in self.config.ip_blacklist \
+                    or (rpc_address in cluster.private_rpc_nodes and not self.with_private_rpc):
+                continue
+            rpc_node, _ = self.make_record(rpc_address, inc_probe, full_probe)
+            if rpc_node is not None:
+                self.result.rpc_nodes.append(rpc_node)
+        logger.info(f'Found suitable RPCs for {self.config.snapshot_path}: {len(self.result.rpc_nodes)}')
+        self.save_result(len(cluster.probes))
+
+    def save_result(self, total_rpc_nodes: int):
+        # sort list of rpc node by sort_order (score - the expected time until the validator is ready)
+        self.result.rpc_nodes.sort(key=lambda node: getattr(node, self.config.sort_order))
+        self.result.last_update_at = time.time()
+        self.result.last_update_slot = self.current_slot
+        self.result.total_rpc_nodes = total_rpc_nodes
+        self.result.cluster_nodes = self.cluster_versions
+
+        self.result.save(self.result_path)
+        logger.info(f'All data is saved to json file - {self.result_path}')
+
+    def scan(self):
+        """Finds the rpc nodes serving suitable snapshots without downloading anything.
+        Returns the ScanResult (also saved to snapshot.json) or None if the rpc does not respond"""
+        if not self.update_current_slot():
+            return None
+        rpc_nodes = self.get_rpc_nodes()
+        if rpc_nodes is None:
+            return None
+        self.find_local_snapshot()
+        self.result = ScanResult()
+        self.scan_nodes(rpc_nodes, total_rpc_nodes=len(rpc_nodes))
+        return self.result
+
+    def find_mirrors(self, rpc_node: NodeRecord, path: str) -> list:
+        """Other suitable nodes serving the same archive (in sort_order), no more than swarm_sources - 1"""
+        mirrors = []
+        for node in self.result.rpc_nodes:
+            if len(mirrors) >= self.config.swarm_sources - 1:
+                break
+            if node.snapshot_address == rpc_node.snapshot_address or node.snapshot_address in self.unsuitable_servers:
+                continue
+            if path in node.files_to_download:
+                mirrors.append(f'http://{node.snapshot_address}{path}')
+        return mirrors
+
+    def spool_dir(self, rpc_node: NodeRecord):
+        # the speed test downloads the beginning of the full snapshot, it is worth keeping if that snapshot will be
+        # downloaded by the built-in downloader
+        if self.wget_path is None and any(str(path).startswith('/snapshot-')
+                                          and path.split('-')[1] != self.full_local_snap_slot
+                                          for path in rpc_node.files_to_download):
+            return self.config.snapshot_path
+        return None
+
+    def reject_archive(self, urls: list, archiveErr: ArchiveError):
+        """Excludes the nodes that served a corrupted archive"""
+        logger.error(f'The downloaded archive is corrupted --> delete it and skip {len(urls)} node(s)\n{archiveErr}')
+        for url in urls:
+            self.unsuitable_servers.add(urlparse(url).netloc)
+        # with several sources there is no telling which one is to blame, only a single source is remembered
+        if len(urls) == 1:
+            self.node_cache.record_corrupt(urlparse(urls[0]).netloc)
+            self.node_cache.save()
+
+    def download(self, url: str, mirrors: list = None, head_stream: ProbeStream = None,
+                 downloader: Downloader = None, race: bool = False) -> bool:
+        """See Downloader.download(), self.downloader is used by default.
+        Returns True if the archive was downloaded (and verified with config.verify)"""
+        fname = url[url.rfind('/'):].replace("/", "")
+        archive = 'incremental' if fname.startswith('incremental') else 'full'
+        start_time = time.monotonic()
+        downloader = downloader or self.downloader
+
+        try:
+            path = downloader.download(url, mirrors, head_stream, race)
+            # the parts taken over from the speed test or a previous run are counted too
+            size = os.path.getsize(path)
+            seconds = time.monotonic() - start_time
+            self.metrics.inc('downloads', archive=archive, result='ok')
+            self.metrics.inc('download_bytes', size, archive=archive)
+            self.metrics.observe('download_seconds', seconds, archive=archive)
+            self.metrics.observe('download_bytes_per_second', size / max(seconds, 1e-3), buckets=SPEED_BUCKETS,
+                                 archive=archive)
+            return True
+
+        except DiskSpaceError:
+            # no other node helps, the run stops
+            self.metrics.inc('downloads', archive=archive, result='no_space')
+            raise
+
+        except ArchiveError as archiveErr:
+            self.metrics.inc('downloads', archive=archive, result='corrupted')
+            urls = [url] + (mirrors or [])
+            self.reject_archive(urls[:1] if downloader.wget_path is not None else urls, archiveErr)
+
+        except (RequestException, OSError) as downlErr:
+            self.metrics.inc('downloads', archive=archive, result='error')
+            logger.error(f'Exception in download() func\n{downlErr}')
+
+        except Exception as unknwErr:
+            self.metrics.inc('downloads', archive=archive, result='error')
+            logger.error(f'Exception in download() func. Make sure wget is installed\n{unknwErr}')
+        return False
+
+    def locate_incremental(self, rpc_node: NodeRecord, path: str) -> tuple:
+        """The incremental snapshot of rpc_node is probed again, a newer one may have appeared since the discovery.
+        With race_incremental > 1 the next suitable nodes are probed at the same time.
+        Returns the current path of the incremental snapshot and the urls of the other nodes serving it,
+        no more than race_incremental - 1"""
+        race = self.config.race_incremental - 1 if self.wget_path is None else 0
+        others = [node.snapshot_address for node in self.result.rpc_nodes
+                  if node.snapshot_address != rpc_node.snapshot_address
+                  and node.snapshot_address not in self.unsuitable_servers and not self.is_blacklisted(node)
+                  and any('incremental' in str(node_path) for node_path in node.files_to_download)]
+        others = others[:race * RACE_PROBE_FACTOR]
+
+        async def probe_all():
+            # reuses the keep-alive connections of the discovery probes
+            return await asyncio.gather(*(probe_snapshot_locations(
+                self.connection_pool, self.metrics, address, ['/incremental-snapshot.tar.bz2'], timeout_=2)
+                for address in [rpc_node.snapshot_address] + others))
+
+        (inc_probe,), *other_probes = self.event_loop.run_until_complete(probe_all())
+        if inc_probe is not None:
+            path = inc_probe[0]
+        race_urls = [f'http://{address}{path}' for address, (probe,) in zip(others, other_probes)
+                     if probe is not None and probe[0] == path]
+        return path, race_urls[:race]
+
+    def download_snapshots(self, rpc_node: NodeRecord, head_stream: ProbeStream = None) -> bool:
+        """head_stream - speed test stream of this node, continued by the download of the archive it belongs to.
+        Returns False if one of the archives could not be downloaded"""
+        downloaded = True
+        for path in reversed(rpc_node.files_to_download):
+            # do not download full snapshot if it already exists locally
+            if str(path).startswith("/snapshot-"):
+                full_snap_slot__ = path.split("-")[1]
+                if full_snap_slot__ == self.full_local_snap_slot:
+                    continue
+
+            race_urls = []
+            if 'incremental' in path:
+                path, race_urls = self.locate_incremental(rpc_node, path)
+
+            best_snapshot_node = f'http://{rpc_node.snapshot_address}{path}'
+            logger.info(f'Downloading {best_snapshot_node} snapshot to {self.config.snapshot_path}')
+            if race_urls:
+                downloaded = self.download(url=best_snapshot_node, mirrors=race_urls, race=True)
+            elif head_stream is not None and head_stream.path == path:
+                downloaded = self.download(url=best_snapshot_node, mirrors=self.find_mirrors(rpc_node, path),
+                                           head_stream=head_stream)
+                head_stream = None
+            else:
+                downloaded = self.download(url=best_snapshot_node, mirrors=self.find_mirrors(rpc_node, path))
+            if not downloaded:
+                break
+            if str(path).startswith("/snapshot-"):
+                # the next node does not download it again
+                self.full_local_snap_slot = path.split("-")[1]
+
+        if head_stream is not None:
+            head_stream.close()
+        return downloaded
+
+    def record_speed_test(self, rpc_node: NodeRecord, speed: float):
+        self.node_cache.record_speed(rpc_node.snapshot_address, speed)
+        if speed < self.config.min_download_speed_bytes:
+            self.slow_groups.add(self.topology.group(rpc_node.snapshot_address))
+        self.metrics.observe('speed_test_bytes_per_second', speed, buckets=SPEED_BUCKETS)
+        self.metrics.inc('speed_tests', result='suitable' if speed >= self.config.min_download_speed_bytes else 'slow')
+
+    def is_blacklisted(self, rpc_node: NodeRecord) -> bool:
+        # filter blacklisted snapshots
+        return any(i in str(rpc_node.files_to_download) for i in self.config.blacklist)
+
+    def speed_test_order(self, rpc_nodes: list):
+        """The found nodes in the order of the speed tests: one node of every network group first (the groups in
+        sort_order of their best node). The other nodes of a group whose node was too slow are tested last"""
+        deferred = []
+        for rpc_node in self.topology.interleave(rpc_nodes, key=lambda node: node.snapshot_address):
+            if self.topology.group(rpc_node.snapshot_address) in self.slow_groups:
+                deferred.append(rpc_node)
+            else:
+                yield rpc_node
+        yield from deferred
+
+    def select_and_download(self) -> int:
+        """Speed tests the found nodes and downloads the snapshots from the first fast enough one.
+        Returns 0 if the snapshots were downloaded"""
+        config = self.config
+        min_speed = config.min_download_speed_bytes
+        rpc_nodes = self.result.rpc_nodes
+
+        logger.info("TRYING TO DOWNLOADING FILES")
+        if config.tournament_size > 1:
+            candidates = [rpc_node for rpc_node in self.speed_test_order(rpc_nodes) if not self.is_blacklisted(rpc_node)
+                          and rpc_node.snapshot_address not in self.unsuitable_servers][:NUM_OF_RPC_TO_CHECK]
+            for batch_start in range(0, len(candidates), config.tournament_size):
+                batch = candidates[batch_start:batch_start + config.tournament_size]
+                with self.metrics.phase('speed_test'):
+                    ranking = speed_tournament(self.session, batch, config.measurement_time, min_speed, self.spool_dir)
+                for rpc_node, down_speed_bytes, stream in ranking:
+                    self.record_speed_test(rpc_node, down_speed_bytes)
+                self.node_cache.save()
+                suitable = [r for r in ranking if r[1] >= min_speed]
+                for rpc_node, down_speed_bytes, stream in ranking:
+                    if stream is not None and (not suitable or rpc_node is not suitable[0][0]):
+                        stream.close()
+                # the next suitable node of the batch is tried if the download from the previous one failed
+                for rpc_node, down_speed_bytes, stream in suitable:
+                    logger.info(f'Suitable snapshot server found: {rpc_node=} down_speed_mb={convert_size(down_speed_bytes)}')
+                    if rpc_node is not suitable[0][0]:
+                        stream = None
+                    with self.metrics.phase('download'):
+                        downloaded = self.download_snapshots(rpc_node, head_stream=stream)
+                    if downloaded:
+                        return 0
+                self.unsuitable_servers.update(rpc_node.snapshot_address for rpc_node in batch)
+
+        else:
+            tested = 0
+            for i, rpc_node in enumerate(self.speed_test_order(rpc_nodes), start=1):
+                if self.is_blacklisted(rpc_node):
+                    logger.info(f'{i}\\{len(rpc_nodes)} BLACKLISTED --> {rpc_node}')
+                    continue
+
+                if rpc_node.snapshot_address in self.unsuitable_servers:
+                    logger.info(f'Rpc node already in unsuitable list --> skip {rpc_node.snapshot_address}')
+                    continue
+
+                if tested >= NUM_OF_RPC_TO_CHECK:
+                    logger.info(f'The limit on the number of RPC nodes from'
+                    f' which we measure the speed has been reached {NUM_OF_RPC_TO_CHECK=}\n')
+                    break
+
+                logger.info(f'{i}\\{len(rpc_nodes)} checking the speed {rpc_node}')
+                tested += 1
+                stream = None
+                try:
+                    with self.metrics.phase('speed_test'):
+                        stream = ProbeStream(self.session, rpc_node.snapshot_address, config.measurement_time,
+                                             self.spool_dir(rpc_node))
+                        down_speed_bytes = speed_score(list(iter_speed_buckets(stream.chunks, config.measurement_time)))
+                except RequestException as speedErr:
+                    # the node is skipped, the next one is tested
+                    if stream is not None:
+                        stream.close()
+                    logger.info(f'Speed test failed: {rpc_node=}\n{speedErr}')
+                    self.metrics.inc('speed_tests', result='error')
+                    self.unsuitable_servers.add(rpc_node.snapshot_address)
+                    continue
+
+                down_speed_mb = convert_size(down_speed_bytes)
+                self.record_speed_test(rpc_node, down_speed_bytes)
+                self.node_cache.save()
+                if down_speed_bytes < min_speed:
+                    logger.info(f'Too slow: {rpc_node=} {down_speed_mb=}')
+                    stream.close()
+                    self.unsuitable_servers.add(rpc_node.snapshot_address)
+                    continue
+
+                logger.info(f'Suitable snapshot server found: {rpc_node=} {down_speed_mb=}')
+                with self.metrics.phase('download'):
+                    downloaded = self.download_snapshots(rpc_node, head_stream=stream)
+                if downloaded:
+                    return 0
+                self.unsuitable_servers.add(rpc_node.snapshot_address)
+
+        return 1
+
+    def download_from_daemon(self) -> int:
+        """Downloads the snapshots from the nodes found by a running daemon (config.from_daemon)
+        instead of scanning the cluster. Returns 0 if the snapshots were downloaded"""
+        try:
+            result = ScanResult.from_dict(daemon_request(self.config.from_daemon,
+                                                         f'/snapshot.json?full_slot={self.full_local_snap_slot}'))
+        except (OSError, ValueError, KeyError, TypeError, http.client.HTTPException) as daemonErr:
+            logger.error(f'Can\'t get the snapshot nodes from the daemon {self.config.from_daemon}\n{daemonErr}')
+            return 1
+        logger.info(f'The daemon {self.config.from_daemon} knows {len(result.rpc_nodes)} suitable rpc nodes')
+        self.result = result
+        return self.select_and_download()
+
+    def run_once(self) -> int:
+        """One attempt: scans the cluster and downloads the snapshots. The current slot must be known.
+        Returns 0 if the snapshots were downloaded"""
+        try:
+            self.find_local_snapshot()
+            self.remove_stale_probes()
+            if self.config.from_daemon is not None:
+                if self.download_from_daemon() == 0:
+                    return 0
+                logger.info(f'No snapshot was downloaded from the nodes of the daemon --> scanning the cluster')
+
+            rpc_nodes = self.get_rpc_nodes()
+            if rpc_nodes is None:
+                return 1
+            logger.info(f'RPC servers in total: {len(rpc_nodes)} | Current slot number: {self.current_slot}\n')
+
+            self.result = ScanResult()
+            for scan_group in self.scan_plan(rpc_nodes):
+                self.scan_nodes(scan_group, total_rpc_nodes=len(rpc_nodes))
+                if self.select_and_download() == 0:
+                    return 0
+
+            if len(self.result.rpc_nodes) == 0:
+                logger.info(f'No snapshot nodes were found matching the given parameters: '
+                            f'{self.config.max_snapshot_age=}')
+                return 1
+
+            logger.error(f'No snapshot nodes were found matching the given parameters:{self.config.min_download_speed=}'
+                  f'\nTry restarting the script with --with_private_rpc')
+            return 1
+
+        except DiskSpaceError:
+            raise
+
+        except Exception as workerErr:
+            logger.error(f'Exception in run_once() func\n{workerErr}')
+            return 1
+
+    def save_metrics(self):
+        self.metrics.set('last_run_duration_seconds', time.time() - self.metrics.started_at)
+        self.metrics.save(self.config.metrics_textfile, f'{self.config.snapshot_path}/run_report.json')
+
+    def run(self) -> int:
+        """Scans the cluster and downloads the snapshots, retrying up to config.num_of_retries times.
+        The metrics of the run are saved in the end. Returns 0 if the snapshots were downloaded, 1 otherwise"""
+        config = self.config
+        self.reset()
+        self.metrics = Metrics()
+        self.metrics.set('last_run_success', 0)
+        self.metrics.set('last_run_timestamp_seconds', self.metrics.started_at)
+        # written on every exit, also when no snapshot was found
+        try:
+            attempt = 1
+            while attempt <= config.num_of_retries:
+                slot_found = self.update_current_slot()
+                logger.info(f'Attempt number: {attempt}. Total attempts: {config.num_of_retries}')
+                attempt += 1
+
+                if not slot_found:
+                    continue
+
+                try:
+                    downloaded = self.run_once() == 0
+                except DiskSpaceError as spaceErr:
+                    logger.error(f'Not enough disk space --> exit\n{spaceErr}')
+                    return 1
+                if downloaded:
+                    self.metrics.set('last_run_success', 1)
+                    logger.info("Done")
+                    return 0
+
+                logger.info("Now trying with flag --with_private_rpc")
+                self.with_private_rpc = True
+
+                if attempt >= config.num_of_retries:
+                    logger.error(f'Could not find a suitable snapshot --> exit')
+                    return 1
+
+                logger.info(f"Sleeping {config.sleep} seconds before next try")
+                with self.metrics.phase('sleep'):
+                    time.sleep(config.sleep)
+            return 1
+
+        finally:
+            self.save_metrics()
@@ -0,0 +1,36 @@
+from .records import NodeRecord, snapshot_slot
+
+# rough sizes of the archives (bytes), the ranking depends on their ratio and on the throughput of the nodes
+FULL_SNAPSHOT_SIZE = 100e9
+INCREMENTAL_SNAPSHOT_SIZE = 2e9
+# the cluster produces this many slots per second, a starting validator replays them at REPLAY_SLOTS_PER_SECOND
+SLOTS_PER_SECOND = 2.5
+REPLAY_SLOTS_PER_SECOND = 5
+# request round trips before the first byte of an archive: the redirect, the connection and the first range
+ROUND_TRIPS = 3
+# throughput of nodes that were never measured is not assumed to be lower than this (bytes/s)
+MIN_EXPECTED_SPEED = 1e6
+# discovery stops early once there are enough candidates whose snapshot is at most this many slots old
+# (a few incremental snapshot intervals) and whose download speed was measured in a previous run
+EARLY_EXIT_MAX_SLOTS_DIFF = 300
+
+
+def download_size(rpc_node: NodeRecord, full_local_snap_slot=None) -> float:
+    """Expected number of bytes to download from rpc_node, the full snapshot on the local disk is not downloaded"""
+    size = 0
+    for path in rpc_node.files_to_download:
+        if not path.startswith('/snapshot-'):
+            size += INCREMENTAL_SNAPSHOT_SIZE
+        elif str(snapshot_slot(path)) != str(full_local_snap_slot):
+            size += FULL_SNAPSHOT_SIZE
+    return size
+
+
+def ready_seconds(rpc_node: NodeRecord, speed: float, full_local_snap_slot=None) -> float:
+    """Expected time until a validator started from the snapshots of rpc_node has caught up with the cluster:
+    the download of the missing archives at speed (bytes/s), the round trips at the latency of the node
+    and the replay of the slots the snapshot is behind by the end of the download"""
+    download_seconds = download_size(rpc_node, full_local_snap_slot) / max(speed, MIN_EXPECTED_SPEED) \
+        + ROUND_TRIPS * rpc_node.latency / 1000
+    slots_behind = max(rpc_node.slots_diff, 0) + download_seconds * SLOTS_PER_SECOND
+    return download_seconds + slots_behind / (REPLAY_SLOTS_PER_SECOND - SLOTS_PER_SECOND)
@@ -0,0 +1,199 @@
+import logging
+import math
+import os
+import statistics
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# nodes are not dropped from the speed test tournament before this time (seconds)
+TOURNAMENT_MIN_TIME = 2
+# relative width of the confidence interval at which the speed estimate is considered precise enough
+TOURNAMENT_PRECISION = 0.2
+
+
+def convert_size(size_bytes):
+   if size_bytes == 0:
+    return "0B"
+   size_name = ("B", "KB", "MB", "GB", "TB", "PB", "EB", "ZB", "YB")
+   i = int(math.floor(math.log(size_bytes, 1024)))
+   p = math.pow(1024, i)
+   s = round(size_bytes / p, 2)
+   return "%s %s" % (s, size_name[i])
+
+
+def iter_speed_buckets(chunks, measure_time: int, stop: threading.Event = None):
+    """Yields the download speed (bytes per second) of the chunk stream measured over ~1 second buckets"""
+    start_time = time.monotonic_ns()
+    last_time = start_time
+    loaded = 0
+    for chunk in chunks:
+        curtime = time.monotonic_ns()
+
+        worktime = (curtime - start_time) / 1000000000
+        if worktime >= measure_time or (stop is not None and stop.is_set()):
+            break
+
+        delta = (curtime - last_time) / 1000000000
+        loaded += len(chunk)
+        if delta > 1:
+            estimated_bytes_per_second = loaded * (1 / delta)
+            yield estimated_bytes_per_second
+
+            last_time = curtime
+            loaded = 0
+
+
+def speed_score(speeds: list) -> float:
+    return statistics.median(speeds) if speeds else 0
+
+
+class ProbeStream:
+    """Speed test stream of /snapshot.tar.bz2. With spool_dir the received bytes are kept in a
+    spool_dir/tmp-<name>.<node>.probe file, so the stream of the chosen node continues as the download of that archive
+    instead of being thrown away"""
+
+    def __init__(self, session: requests.Session, rpc_address: str, measure_time: int, spool_dir: str = None):
+        self.rpc_address = rpc_address
+        self.response = session.get(f'http://{rpc_address}/snapshot.tar.bz2', stream=True, timeout=measure_time + 2)
+        self.spool = None
+        self.loaded = 0
+        try:
+            self.response.raise_for_status()
+            self.path = urlparse(self.response.url).path
+            self.fname = self.path[self.path.rfind('/'):].replace("/", "")
+            self.spool_fname = f'{spool_dir}/tmp-{self.fname}.{rpc_address.replace(":", "_")}.probe'
+            if spool_dir is not None:
+                self.spool = open(self.spool_fname, 'wb')
+        except BaseException:
+            self.response.close()
+            raise
+        self.chunks = self._iter_chunks()
+
+    def _iter_chunks(self):
+        for chunk in self.response.iter_content(chunk_size=81920):
+            if self.spool is not None:
+                self.spool.write(chunk)
+            self.loaded += len(chunk)
+            yield chunk
+
+    def detach_spool(self) -> str:
+        """Stops spooling, the caller takes over the spool file"""
+        self.spool.close()
+        self.spool = None
+        return self.spool_fname
+
+    def close(self):
+        self.response.close()
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+            try:
+                os.remove(self.spool_fname)
+            except OSError:
+                pass
+
+
+def measure_speed(session: requests.Session, rpc_address: str, measure_time: int) -> float:
+    logger.debug('measure_speed()')
+    stream = ProbeStream(session, rpc_address, measure_time)
+    try:
+        return speed_score(list(iter_speed_buckets(stream.chunks, measure_time)))
+    finally:
+        stream.close()
+
+
+class SpeedProbe(threading.Thread):
+    """Speed test of one rpc node running at the same time as the others in speed_tournament()"""
+
+    def __init__(self, session: requests.Session, rpc_node, measure_time: int, spool_dir: str = None):
+        super().__init__(daemon=True)
+        self.session = session
+        self.rpc_node = rpc_node
+        self.measure_time = measure_time
+        self.spool_dir = spool_dir
+        self.stream = None
+        self.speeds = []
+        self.stop = threading.Event()
+        self.error = None
+        self.status = 'finished'
+
+    def run(self):
+        try:
+            self.stream = ProbeStream(self.session, self.rpc_node.snapshot_address, self.measure_time, self.spool_dir)
+            for speed in iter_speed_buckets(self.stream.chunks, self.measure_time, self.stop):
+                self.speeds.append(speed)
+        except Exception as probeErr:
+            self.error = probeErr
+
+    def bounds(self):
+        # 95% confidence interval of the mean bucket speed
+        speeds = list(self.speeds)
+        if len(speeds) < 2:
+            return 0, float('inf')
+        margin = 1.96 * statistics.stdev(speeds) / math.sqrt(len(speeds))
+        return statistics.mean(speeds) - margin, statistics.mean(speeds) + margin
+
+
+def speed_tournament(session: requests.Session, rpc_nodes: list, measure_time: int, min_speed: float,
+                     spool_dir_of=lambda rpc_node: None) -> list:
+    """Measures the download speed of all rpc_nodes (NodeRecord) at once. A node is dropped as soon as it is clearly
+    slower than the leader or than min_speed (bytes/s), the measurement stops once the remaining nodes are tied.
+    spool_dir_of(rpc_node) - where the stream of the node is spooled, see ProbeStream.
+    Returns [(rpc_node, speed, stream)] sorted from the fastest node, the caller owns the (still open) streams"""
+    logger.info(f'Measuring the download speed of {len(rpc_nodes)} rpc nodes at once')
+    probes = [SpeedProbe(session, rpc_node, measure_time, spool_dir_of(rpc_node)) for rpc_node in rpc_nodes]
+    for probe in probes:
+        probe.start()
+
+    start_time = time.monotonic()
+    active = list(probes)
+    while active and time.monotonic() - start_time < measure_time:
+        time.sleep(0.25)
+        elapsed = time.monotonic() - start_time
+        for probe in list(active):
+            if probe.error is not None or not probe.is_alive():
+                probe.status = 'error' if probe.error is not None else 'finished'
+                active.remove(probe)
+        if elapsed < TOURNAMENT_MIN_TIME or not active:
+            continue
+
+        leader = max(active, key=lambda p: p.bounds()[0])
+        leader_low = leader.bounds()[0]
+        for probe in list(active):
+            if probe is leader:
+                continue
+            low, high = probe.bounds()
+            stalled = not probe.speeds and leader.speeds
+            if stalled or high < leader_low or high < min_speed:
+                probe.stop.set()
+                probe.status = f'dropped after {elapsed:.1f}s'
+                active.remove(probe)
+        if len(active) == 1 and len(leader.speeds) >= 2:
+            break
+        # the remaining nodes are tied, measuring longer will not change the ranking noticeably
+        if all(len(p.speeds) >= 2 and p.bounds()[1] - p.bounds()[0] <= TOURNAMENT_PRECISION * p.bounds()[1]
+               for p in active):
+            break
+
+    for probe in probes:
+        probe.stop.set()
+    for probe in probes:
+        probe.join(timeout=2)
+        # dropped nodes will not be downloaded from, a stream still being read by its thread can't be handed over
+        if probe.stream is not None and (probe.error is not None or probe.status != 'finished' or probe.is_alive()):
+            probe.stream.close()
+            probe.stream = None
+
+    ranking = sorted((p for p in probes if p.error is None), key=lambda p: speed_score(p.speeds), reverse=True)
+    table = '\n'.join(f'{n:>3}. {p.rpc_node.snapshot_address:<22} {convert_size(speed_score(p.speeds)):>10}/s'
+                      f' {len(p.speeds):>3} buckets  {p.status}' for n, p in enumerate(ranking, start=1))
+    logger.info(f'Speed test results ({time.monotonic() - start_time:.1f}s):\n{table}')
+    for probe in probes:
+        if probe.error is not None:
+            logger.debug(f'Speed test of {probe.rpc_node.snapshot_address} failed {probe.error}')
+    return [(p.rpc_node, speed_score(p.speeds), p.stream) for p in ranking]
@@ -0,0 +1,128 @@
+import ctypes
+import ctypes.util
+import errno
+import glob
+import logging
+import os
+import shutil
+
+from .records import snapshot_slot
+from .speedtest import convert_size
+
+logger = logging.getLogger(__name__)
+
+# a download must leave at least this much free space (bytes)
+DISK_SPACE_MARGIN = 1024 ** 3
+CLEANUP_POLICIES = ('keep', 'delete', 'archive')
+
+
+class DiskSpaceError(OSError):
+    """There is not enough free space for the archive in the snapshot path"""
+
+
+def _load_fallocate():
+    # fallocate(2) fails right away where the file system can't preallocate, unlike os.posix_fallocate()
+    # which falls back to writing the whole file
+    try:
+        fallocate = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True).fallocate
+    except (OSError, AttributeError, TypeError):
+        return None
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+    return fallocate
+
+
+_fallocate = _load_fallocate()
+
+
+def preallocate(fd: int, size: int):
+    """Sizes the file to size bytes and reserves its blocks, so that the archive is not fragmented and a full disk
+    fails the download at the start. A sparse file is created where the file system can't preallocate"""
+    if _fallocate is not None and size > 0:
+        if _fallocate(fd, 0, 0, size) == 0:
+            return
+        err = ctypes.get_errno()
+        if err == errno.ENOSPC:
+            raise DiskSpaceError(err, f'No space left to preallocate {convert_size(size)}')
+        logger.debug(f'Can\'t preallocate the file: {os.strerror(err)}')
+    os.ftruncate(fd, size)
+
+
+def allocated_size(path: str) -> int:
+    # blocks already taken by a partial download, a sparse file takes less than its size
+    try:
+        return os.stat(path).st_blocks * 512
+    except OSError:
+        return 0
+
+
+class Storage:
+    """Disk space of snapshot_path: the free space check before a download and the snapshots superseded by
+    a downloaded archive. cleanup - what happens to the superseded snapshots: 'keep' them, 'delete' them or
+    'archive' - move them to archive_path. With 'delete' and 'archive' they also make room for a download
+    that does not fit"""
+
+    def __init__(self, snapshot_path: str, cleanup: str = 'keep', archive_path: str = None):
+        if cleanup not in CLEANUP_POLICIES:
+            raise ValueError(f'Unknown cleanup policy {cleanup!r}, expected one of {", ".join(CLEANUP_POLICIES)}')
+        if cleanup == 'archive' and not archive_path:
+            raise ValueError('The archive cleanup policy requires archive_path')
+        self.snapshot_path = snapshot_path
+        self.cleanup = cleanup
+        self.archive_path = archive_path
+
+    def superseded(self, fname: str) -> list:
+        """Local snapshots made useless by the archive fname: a full snapshot supersedes the older full snapshots
+        and the incremental snapshots based on them, an incremental snapshot - the older incremental snapshots"""
+        slot = snapshot_slot(fname)
+        if slot is None:
+            return []
+        paths = []
+        if fname.startswith('snapshot-'):
+            for path in glob.glob(f'{self.snapshot_path}/snapshot-*tar*'):
+                full_slot = snapshot_slot(os.path.basename(path))
+                if full_slot is not None and full_slot < slot:
+                    paths.append(path)
+        for path in glob.glob(f'{self.snapshot_path}/incremental-snapshot-*tar*'):
+            name = os.path.basename(path)
+            try:
+                base_slot = int(name.split('-')[2])
+            except (IndexError, ValueError):
+                continue
+            inc_slot = snapshot_slot(name)
+            if inc_slot is None or name == fname:
+                continue
+            if (fname.startswith('snapshot-') and base_slot < slot) or \
+                    (fname.startswith('incremental') and inc_slot < slot):
+                paths.append(path)
+        return sorted(paths)
+
+    def clean(self, fname: str) -> list:
+        """Applies the cleanup policy to the snapshots superseded by fname. Returns the removed paths"""
+        if self.cleanup == 'keep':
+            return []
+        paths = self.superseded(fname)
+        for path in paths:
+            if self.cleanup == 'archive':
+                logger.info(f'Moving the superseded snapshot {path} to {self.archive_path}')
+                os.makedirs(self.archive_path, exist_ok=True)
+                shutil.move(path, os.path.join(self.archive_path, os.path.basename(path)))
+            else:
+                logger.info(f'Deleting the superseded snapshot {path}')
+                os.remove(path)
+        return paths
+
+    def preflight(self, fname: str, size: int, temp_fname: str):
+        """Checks that the archive fname of size bytes fits into the snapshot path before its download starts,
+        the superseded snapshots are cleaned up first if that makes room for it. Raises DiskSpaceError"""
+        needed = size - allocated_size(temp_fname) + DISK_SPACE_MARGIN
+        free = shutil.disk_usage(self.snapshot_path).free
+        # the superseded snapshots are not removed in vain if the archive does not fit even without them
+        if free < needed and self.cleanup != 'keep' \
+                and free + sum(allocated_size(path) for path in self.superseded(fname)) >= needed:
+            self.clean(fname)
+            free = shutil.disk_usage(self.snapshot_path).free
+        if free < needed:
+            raise DiskSpaceError(errno.ENOSPC, f'{fname} needs {convert_size(needed)} including a reserve of '
+                                 f'{convert_size(DISK_SPACE_MARGIN)}, only {convert_size(free)} are free in '
+                                 f'{self.snapshot_path}')
+        logger.debug(f'{fname}: {convert_size(size)}, {convert_size(free)} free in {self.snapshot_path}')
@@ -0,0 +1,83 @@
+import bisect
+import gzip
+import ipaddress
+import logging
+import socket
+
+logger = logging.getLogger(__name__)
+
+# ipv6 addresses are grouped by this prefix length, a /48 is the usual allocation of one site
+IPV6_PREFIX = 48
+
+
+class Topology:
+    """Groups rpc nodes that most likely share a datacenter or a network, so that one node of every group is probed
+    and speed tested before the others. Nodes are grouped by the autonomous system from an offline ip to asn database
+    (asn_db - the ip2asn tsv file of https://iptoasn.com, optionally gzipped) or else by the /subnet_prefix
+    of their ipv4 address. subnet_prefix=0 and no asn_db - every node is a group of its own"""
+
+    def __init__(self, subnet_prefix: int = 24, asn_db: str = None):
+        self.subnet_prefix = subnet_prefix
+        # ip version -> sorted range starts, range ends and as numbers
+        self.ranges = {}
+        if asn_db is not None:
+            self.load_asn_db(asn_db)
+
+    def load_asn_db(self, path: str):
+        ranges = {4: [], 6: []}
+        try:
+            with (gzip.open(path, 'rt') if path.endswith('.gz') else open(path)) as asn_f:
+                for line in asn_f:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) < 3 or fields[2] == '0':
+                        # not routed
+                        continue
+                    # socket.inet_pton is much faster than ipaddress on the ~500k lines of the database
+                    family, version = (socket.AF_INET6, 6) if ':' in fields[0] else (socket.AF_INET, 4)
+                    ranges[version].append((int.from_bytes(socket.inet_pton(family, fields[0]), 'big'),
+                                            int.from_bytes(socket.inet_pton(family, fields[1]), 'big'), int(fields[2])))
+        except (OSError, ValueError, EOFError) as asnErr:
+            logger.error(f'Can\'t load the asn database {path}, the rpc nodes are grouped by subnets\n{asnErr}')
+            return
+
+        for version, version_ranges in ranges.items():
+            version_ranges.sort()
+            self.ranges[version] = tuple(map(list, zip(*version_ranges))) if version_ranges else ([], [], [])
+        logger.info(f'Loaded {sum(map(len, ranges.values()))} ip ranges from the asn database {path}')
+
+    def asn(self, ip):
+        """As number of the ip address or None if it is not in the database"""
+        starts, ends, asns = self.ranges.get(ip.version, ([], [], []))
+        i = bisect.bisect_right(starts, int(ip)) - 1
+        if i >= 0 and int(ip) <= ends[i]:
+            return asns[i]
+        return None
+
+    def group(self, rpc_address: str) -> str:
+        host = rpc_address.rpartition(':')[0].strip('[]')
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            return host
+
+        asn = self.asn(ip)
+        if asn is not None:
+            return f'AS{asn}'
+        if self.subnet_prefix <= 0:
+            return str(ip)
+        prefix = min(self.subnet_prefix, 32) if ip.version == 4 else IPV6_PREFIX
+        return str(ipaddress.ip_network(f'{ip}/{prefix}', strict=False))
+
+    def interleave(self, items: list, key=lambda item: item) -> list:
+        """items one group after another: the first item of every group (in the order of the groups' first items),
+        then the second ones and so on. key - rpc address of an item"""
+        groups = {}
+        for item in items:
+            groups.setdefault(self.group(key(item)), []).append(item)
+        rounds = []
+        for members in groups.values():
+            for n, item in enumerate(members):
+                if n == len(rounds):
+                    rounds.append([])
+                rounds[n].append(item)
+        return [item for round_ in rounds for item in round_]
@@ -0,0 +1,188 @@
+import bz2
+import logging
+import os
+import threading
+import time
+import zlib
+
+# needed to verify .tar.zst and .tar.lz4 archives (requirements.txt), --verify refuses to start without them
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+logger = logging.getLogger(__name__)
+
+VERIFY_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class ArchiveError(Exception):
+    """The downloaded file is not a valid snapshot archive"""
+
+
+class TarWalker:
+    """Follows the tar headers of a stream that is fed in arbitrary pieces: checks the header checksums,
+    skips the data of the members and expects the end-of-archive block"""
+
+    def __init__(self):
+        self.header = bytearray()
+        self.skip = 0
+        self.members = 0
+        self.finished = False
+
+    def feed(self, data: bytes):
+        data = memoryview(data)
+        while data and not self.finished:
+            if self.skip:
+                skipped = min(self.skip, len(data))
+                self.skip -= skipped
+                data = data[skipped:]
+                continue
+            needed = 512 - len(self.header)
+            self.header += data[:needed]
+            data = data[needed:]
+            if len(self.header) == 512:
+                self._parse(bytes(self.header))
+                self.header.clear()
+
+    def _parse(self, header: bytes):
+        if not any(header):
+            self.finished = True
+            return
+        # the checksum is calculated with the checksum field itself filled with spaces
+        checksum = sum(header[:148]) + 8 * ord(' ') + sum(header[156:])
+        try:
+            stored = int(header[148:156].strip(b' \0') or b'0', 8)
+        except ValueError:
+            stored = None
+        if stored != checksum:
+            raise ArchiveError(f'broken tar header after {self.members} members')
+        self.skip = (self._size(header[124:136]) + 511) // 512 * 512
+        self.members += 1
+
+    @staticmethod
+    def _size(field: bytes) -> int:
+        if field[0] & 0x80:
+            # base-256 encoding of large sizes
+            return int.from_bytes(bytes([field[0] & 0x7f]) + field[1:], 'big')
+        try:
+            return int(field.strip(b' \0') or b'0', 8)
+        except ValueError:
+            raise ArchiveError('broken size field in a tar header')
+
+
+class FrameChain:
+    """Decompresses the concatenated frames (zstd, lz4) or streams (bz2, gzip) of an archive, every decompressor
+    object stops at the end of the first one. A new one is made by factory for every following frame"""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.decompressor = factory()
+
+    @property
+    def eof(self) -> bool:
+        return self.decompressor.eof
+
+    def decompress(self, data: bytes) -> bytes:
+        decompressed = []
+        while data:
+            if self.decompressor.eof:
+                self.decompressor = self.factory()
+            decompressed.append(self.decompressor.decompress(data))
+            data = self.decompressor.unused_data if self.decompressor.eof else b''
+        return b''.join(decompressed)
+
+
+class ArchiveVerifier:
+    """Decompresses a snapshot archive that is fed in order and walks its tar structure.
+    decompressor is None if the compression of the archive can't be decoded here"""
+
+    def __init__(self, fname: str):
+        self.fname = fname
+        self.decompressor = self._decompressor(fname)
+        self.tar = TarWalker()
+        self.loaded = 0
+
+    @staticmethod
+    def _decompressor(fname: str):
+        if fname.endswith('.tar.zst'):
+            return FrameChain(lambda: zstandard.ZstdDecompressor().decompressobj()) if zstandard is not None else None
+        if fname.endswith('.tar.lz4'):
+            return FrameChain(lz4.frame.LZ4FrameDecompressor) if lz4 is not None else None
+        if fname.endswith('.tar.bz2'):
+            return FrameChain(bz2.BZ2Decompressor)
+        if fname.endswith('.tar.gz'):
+            return FrameChain(lambda: zlib.decompressobj(zlib.MAX_WBITS | 16))
+        return None
+
+    def feed(self, data: bytes):
+        try:
+            decompressed = self.decompressor.decompress(data)
+        # every decompressor raises its own exception type (OSError, EOFError, zlib.error, ZstdError, RuntimeError)
+        except Exception as decompressErr:
+            raise ArchiveError(f'{self.fname} can\'t be decompressed after {self.loaded} bytes: {decompressErr}')
+        self.loaded += len(data)
+        try:
+            self.tar.feed(decompressed)
+        except ArchiveError as tarErr:
+            raise ArchiveError(f'{self.fname}: {tarErr}')
+
+    def close(self):
+        if not self.decompressor.eof or not self.tar.finished:
+            raise ArchiveError(f'{self.fname} is truncated')
+        logger.info(f'{self.fname} is verified: {self.tar.members} files')
+
+
+def missing_decoders() -> list:
+    """Packages that are needed to verify the archives of the clusters and are not installed"""
+    return [name for name, module in (('zstandard', zstandard), ('lz4', lz4)) if module is None]
+
+
+def make_verifier(fname: str):
+    """Returns None if the archive can't be verified"""
+    verifier = ArchiveVerifier(fname)
+    if verifier.decompressor is None:
+        logger.warning(f'Can\'t verify {fname}, install zstandard and lz4 to verify .tar.zst and .tar.lz4 archives')
+        return None
+    return verifier
+
+
+def verify_file(verifier: ArchiveVerifier, path: str, close: bool = True):
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(VERIFY_BLOCK_SIZE), b''):
+            verifier.feed(block)
+    if close:
+        verifier.close()
+
+
+def downloaded_prefix(segments: list, lock: threading.Lock) -> int:
+    # segments are downloaded from their start, so the prefix ends inside the first unfinished segment
+    with lock:
+        prefix = 0
+        for segment in segments:
+            prefix = segment["start"] + segment["done"]
+            if segment["done"] < segment["end"] - segment["start"] + 1:
+                break
+        return prefix
+
+
+def verify_segments(verifier: ArchiveVerifier, fd: int, size: int, segments: list, lock: threading.Lock,
+                    stop: threading.Event):
+    """Feeds the verifier with the downloaded prefix of the file as it grows. The bytes are read shortly after
+    they were written, so they usually come from the page cache"""
+    offset = 0
+    while offset < size:
+        prefix = downloaded_prefix(segments, lock)
+        if prefix <= offset:
+            if stop.is_set():
+                return
+            time.sleep(0.2)
+            continue
+        block = os.pread(fd, min(VERIFY_BLOCK_SIZE, prefix - offset), offset)
+        verifier.feed(block)
+        offset += len(block)
+    verifier.close()